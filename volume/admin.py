@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import DataDay, Symbol, Chart, Correlation, MarketHoliday, SystemSetting
+from .models import DataDay, Symbol, Chart, Correlation, MarketHoliday, SystemSetting, ConstituentDay
 
 
 @admin.register(DataDay)
@@ -10,6 +10,15 @@ class DataDayAdmin(admin.ModelAdmin):
     list_filter = ("state", )
 
 
+@admin.register(ConstituentDay)
+class ConstituentDayAdmin(admin.ModelAdmin):
+    date_hierarchy = "day"
+    list_display = ("symbol", "day", "created")
+    search_fields = ("symbol", )
+    fields = ("symbol", "day", "created")
+    readonly_fields = ("created", )
+
+
 @admin.register(Symbol)
 class SymbolAdmin(admin.ModelAdmin):
     list_display = ("symbol", "type", "active")
@@ -1,6 +1,9 @@
 import datetime
+import threading
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from django.utils import timezone
 
@@ -11,6 +14,15 @@ BASE_URL = "https://api.polygon.io"
 
 TIMEOUT = 20
 
+POOL_SIZE = 10
+RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_pool_size = None
+_session_lock = threading.Lock()
+
 
 def to_nanos(dt):
     return int(dt.timestamp()) * 10**9
@@ -24,27 +36,80 @@ def calc_mid(quote):
     return (quote["bid_price"] + quote["ask_price"]) / 2
 
 
+def make_session(pool_size=POOL_SIZE):
+    retry = Retry(
+        total=RETRIES,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=["GET"],
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def configure_session(pool_size):
+    # Size the shared pool to the number of threads that will use it
+    global _session, _session_pool_size
+
+    with _session_lock:
+        if _session is not None and _session_pool_size == pool_size:
+            return
+
+        old_session = _session
+        _session = make_session(pool_size)
+        _session_pool_size = pool_size
+
+    if old_session is not None:
+        old_session.close()
+
+
+def get_session():
+    global _session, _session_pool_size
+
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+            _session_pool_size = POOL_SIZE
+        return _session
+
+
 def base_api_request(endpoint, params, raise_for_status=True):
     url = BASE_URL + endpoint
     params["apiKey"] = API_KEY
-    r = requests.get(url, params=params, timeout=TIMEOUT)
+    r = get_session().get(url, params=params, timeout=TIMEOUT)
     if raise_for_status:
         r.raise_for_status()
     return r.json()
 
 
-def api_request(endpoint, params, follow_cursor=False):
+def api_pages(endpoint, params):
+    # Results one page at a time, following next_url, so callers can
+    # convert each page before the next is fetched
     r_json = base_api_request(endpoint, params)
     assert r_json["status"] == "OK"
-    results = r_json.get("results", [])
+    yield r_json.get("results", [])
+
+    while (next_url := r_json.get("next_url")):
+        r = get_session().get(next_url, params={"apiKey": API_KEY}, timeout=TIMEOUT)
+        r.raise_for_status()
+        r_json = r.json()
+        assert r_json["status"] == "OK"
+        yield r_json.get("results", [])
 
-    if follow_cursor:
-        while (next_url := r_json.get("next_url")):
-            r = requests.get(next_url, params={"apiKey": API_KEY}, timeout=TIMEOUT)
-            r.raise_for_status()
-            assert r.json()["status"] == "OK"
-            results += r.json()["results"]
 
+def api_request(endpoint, params, follow_cursor=False):
+    pages = api_pages(endpoint, params)
+    if not follow_cursor:
+        return next(pages)
+
+    results = []
+    for page in pages:
+        results += page
     return results
 
 
@@ -76,30 +141,32 @@ def index_values_for_day(index_api_symbol, day):
 
 
 
-def trade_minute(symbol, minute):
-    end = minute + datetime.timedelta(minutes=1)
-    params = {
-        "timestamp.gte": to_nanos(minute),
+def range_params(start, end):
+    return {
+        "timestamp.gte": to_nanos(start),
         "timestamp.lt": to_nanos(end),
         "sort": "timestamp",
         "order": "asc",
         "limit": 50000,
     }
 
-    return api_request("/v3/trades/" + symbol, params)
+
+def trade_minute(symbol, minute):
+    end = minute + datetime.timedelta(minutes=1)
+    return api_request("/v3/trades/" + symbol, range_params(minute, end))
 
 
 def quote_minute(symbol, minute):
     end = minute + datetime.timedelta(minutes=1)
-    params = {
-        "timestamp.gte": to_nanos(minute),
-        "timestamp.lt": to_nanos(end),
-        "sort": "timestamp",
-        "order": "asc",
-        "limit": 50000,
-    }
+    return api_request("/vX/quotes/" + symbol, range_params(minute, end))
+
+
+def trade_pages(symbol, start, end):
+    return api_pages("/v3/trades/" + symbol, range_params(start, end))
+
 
-    return api_request("/vX/quotes/" + symbol, params)
+def quote_pages(symbol, start, end):
+    return api_pages("/vX/quotes/" + symbol, range_params(start, end))
 
 
 def mid_last(symbol, time):
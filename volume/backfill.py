@@ -1,17 +1,29 @@
 import concurrent.futures
 import datetime
+import functools
 import logging
+import math
+import multiprocessing
+import os
+import socket
+import threading
 import time
 
+import django
+import django.db
+import numpy
 from django.db import transaction
 from django.db.models import F, Q
 from django.utils import timezone
 
 from . import api
+from . import bulk
 from . import calculate
+from . import day_cache
 from . import logic
 from . import market
-from .models import Symbol, Minute, DataDay, MinuteData, RollingCorrelation
+from . import pipeline
+from .models import Symbol, Minute, DataDay, MinuteData, ConstituentDay
 
 
 SLEEP_TIME = datetime.timedelta(seconds=5)
@@ -19,7 +31,33 @@ RETRY_WAIT_TIME = datetime.timedelta(minutes=15)
 
 NUM_THREADS = 10
 NUM_INDEX_THREADS = 10
-
+# Index days processed at once, each with its own pool for constituents
+INDEX_DAYS = 2
+
+# Minutes are worked out from the fetched ticks in a pool of processes shared
+# by all fetch threads
+NUM_PROCESSES = os.cpu_count()
+_compute_pool = None
+_compute_pool_lock = threading.Lock()
+
+# Stock days go through a fetch -> compute -> store pipeline. Each stage has
+# its own threads and a bounded queue in front of it; the fetch queue limits
+# how many days are claimed ahead of the fetch threads.
+FETCH_THREADS = NUM_THREADS
+FETCH_QUEUE_SIZE = NUM_THREADS
+COMPUTE_THREADS = NUM_PROCESSES
+COMPUTE_QUEUE_SIZE = 2 * NUM_PROCESSES
+STORE_THREADS = 2
+STORE_QUEUE_SIZE = 4
+PIPELINE_POLL_TIME = datetime.timedelta(seconds=1)
+STATS_INTERVAL = datetime.timedelta(minutes=1)
+
+# Days are claimed with a lease so several backfill processes can share the
+# queue. Leases are renewed while a day is being fetched; if a worker dies
+# its leases run out and the days return to PENDING.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+LEASE_TIME = datetime.timedelta(minutes=10)
+HEARTBEAT_INTERVAL = datetime.timedelta(minutes=1)
 
 
 def get_day_data(symbols, day):
@@ -42,42 +80,72 @@ def raw_stock_day_data_with_symbol(symbol, day):
     return symbol, raw_stock_day_data(symbol, day)
 
 
-def raw_stock_day_data(symbol, day):
-    results = []
-    cumulative_volume = 0
-    cumulative_slope = 0
+def compute_pool():
+    # Workers are spawned rather than forked so they don't inherit this
+    # process's threads or database connections
+    global _compute_pool
+    with _compute_pool_lock:
+        if _compute_pool is None:
+            _compute_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=NUM_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=django.setup)
+        return _compute_pool
 
-    last_mid = None
-    previous_last = None
 
-    for dt in market.all_trading_minutes(day):
-        if last_mid is None:
-            last_mid = api.mid_last(symbol, dt)
+def day_ticks(symbol, day):
+    # Fetch a day's trades and quotes as compact arrays, converting each page
+    # as it arrives so at most one page of JSON results is held at a time
+    market_open, market_close = market.open_close(day)
 
-        trade = api.trade_minute(symbol, dt)
-        quote = api.quote_minute(symbol, dt)
+    trades = [calculate.day_trade_arrays(page) for page in api.trade_pages(symbol, market_open, market_close)]
+    quotes = [calculate.quote_arrays(page) for page in api.quote_pages(symbol, market_open, market_close)]
 
-        volume, last_mid = calculate.calculate(quote, trade, last_mid)
-        cumulative_volume += volume
-        last = calculate.last_price(trade)
-        if last is None:
-            last = previous_last
-        else:
-            previous_last = last
+    trade_times, prices, sizes = (numpy.concatenate(arrays) for arrays in zip(*trades))
+    quote_times, bids, asks = (numpy.concatenate(arrays) for arrays in zip(*quotes))
+    return quote_times, bids, asks, trade_times, prices, sizes
 
-        slope = calculate.calculate_slope(volume)
-        cumulative_slope += slope
 
-        # logging.info(f"{symbol}\t{dt}\t{volume}\t{cumulative_volume}\t{last_mid}\t{slope}\t{cumulative_slope}")
+def fetch_stock_day(symbol, day):
+    minutes = list(market.all_trading_minutes(day))
+    minute_times = numpy.array([api.to_nanos(dt) for dt in minutes], dtype=numpy.int64)
+
+    ticks = day_ticks(symbol, day)
+    mid = api.mid_last(symbol, minutes[0])
+    return minutes, minute_times, ticks, mid
+
+
+def compute_stock_day(symbol, fetched):
+    minutes, minute_times, ticks, mid = fetched
+
+    # The calling thread waits here while the minutes are worked out in a
+    # worker process, so CPU work isn't serialised with the fetching by the GIL
+    future = compute_pool().submit(calculate.minute_arrays, minute_times, *ticks, mid)
+    volumes, cumulative_volumes, lasts, last_mids, slopes = (a.tolist() for a in future.result())
 
-        results.append(MinuteData(dt, symbol, last, volume, cumulative_volume, last_mid, cumulative_slope))
+    results = []
+    for i, dt in enumerate(minutes):
+        last = None if math.isnan(lasts[i]) else lasts[i]
+        results.append(MinuteData(dt, symbol, last, volumes[i], cumulative_volumes[i], last_mids[i], slopes[i]))
 
     return results
 
 
-def stock_day_data(symbol, day):
-    data = raw_stock_day_data(symbol.symbol, day)
-    return [Minute.from_minute_data(elem, symbol) for elem in data]
+def raw_stock_day_data(symbol, day):
+    return compute_stock_day(symbol, fetch_stock_day(symbol, day))
+
+
+def stored_constituent_days(symbols, day):
+    minutes = list(market.all_trading_minutes(day))
+    return {constituent.symbol: constituent.to_minute_data(minutes)
+            for constituent in ConstituentDay.objects.filter(symbol__in=symbols, day=day)}
+
+
+def store_constituent_days(day, results):
+    # Another worker may have stored the same day for another index
+    ConstituentDay.objects.bulk_create(
+        [ConstituentDay.from_minute_data(symbol, day, data) for symbol, data in results.items()],
+        ignore_conflicts=True)
 
 
 def calculate_index_minutes(symbol_obj, weights, values, day):
@@ -140,7 +208,14 @@ def index_day_data(symbol_obj, day):
     existing_set = set(dataday.symbol.symbol for dataday in existing)
     needed = all_symbols - existing_set
 
-    new_values = get_day_data(needed, day)
+    # Constituents without a complete day of their own are worked out once
+    # and kept, so other indices and later runs don't fetch them again
+    new_values = stored_constituent_days(needed, day)
+    logging.info(f"Stored constituents: {len(new_values)}/{len(needed)}")
+
+    computed = get_day_data(needed - set(new_values), day)
+    store_constituent_days(day, computed)
+    new_values.update(computed)
 
     for symbol in existing_set:
         logging.info(f"DB get {symbol}")
@@ -153,37 +228,35 @@ def index_day_data(symbol_obj, day):
     return index_data
 
 
-def day_data(symbol, day):
-    if symbol.type == Symbol.Type.STOCK:
-        data = stock_day_data(symbol, day)
-    elif symbol.type == Symbol.Type.INDEX:
-        data = index_day_data(symbol, day)
-
-    rolling_correlations = logic.rolling_correlations_for_day(symbol, day, data)
-
-    try:
-        volume_correlation, slope_correlation = logic.correlation_objects(symbol, day, data)
-        return data, [volume_correlation, slope_correlation], rolling_correlations
-    except (TypeError, ValueError):
-        return data, [], rolling_correlations
-
+class LeaseLost(Exception):
+    pass
 
 
 @transaction.atomic
-def store_day_data(day, data, correlation_objects, rolling_correlations):
-    day.state = DataDay.State.COMPLETE
-    day.last_tried = None
-    day.save()
-    Minute.objects.bulk_create(data)
-    RollingCorrelation.objects.bulk_create(rolling_correlations)
-    for corr in correlation_objects:
-        corr.save()
+def store_day_data(day, data, rolling_correlations):
+    # Only store if this worker still holds the day
+    updated = (DataDay.objects.filter(id=day.id, state=DataDay.State.RUNNING, lease_owner=WORKER_ID)
+               .update(state=DataDay.State.COMPLETE, last_tried=None, lease_owner=None, lease_expires=None,
+                       modified=timezone.now()))
+    if not updated:
+        raise LeaseLost(f"Lease on {day} expired")
+
+    bulk.copy_objects(data, bulk.MINUTE_KEY)
+    bulk.copy_objects(rolling_correlations, bulk.ROLLING_CORRELATION_KEY)
+    logic.update_correlations([day.symbol], day.day, day.day)
+    logic.update_day_summaries([day.symbol], day.day, day.day)
+    transaction.on_commit(functools.partial(day_cache.invalidate, day.symbol.symbol, day.day))
 
 
 def load_data_for_day(day_object):
-    data, correlation_objects, rolling_correlations = day_data(day_object.symbol, day_object.day)
-    store_day_data(day_object, data, correlation_objects, rolling_correlations)
+    if day_object.symbol.type == Symbol.Type.STOCK:
+        # The stock pipeline's stages, run one after another
+        computed = compute_stage(day_object, fetch_stage(day_object, None))
+    else:
+        data = index_day_data(day_object.symbol, day_object.day)
+        computed = data, logic.rolling_correlations_for_day(day_object.symbol, day_object.day, data)
 
+    store_day_data(day_object, *computed)
 
 
 def get_outstanding_days(symbol_type=None):
@@ -196,6 +269,42 @@ def get_outstanding_days(symbol_type=None):
     return days_to_get
 
 
+@transaction.atomic
+def claim_days(symbol_type, limit):
+    # Lease up to limit outstanding days, skipping rows other workers have locked
+    ids = list(get_outstanding_days(symbol_type)
+               .select_for_update(skip_locked=True, of=("self",))
+               .values_list("id", flat=True)[:limit])
+
+    now = timezone.now()
+    DataDay.objects.filter(id__in=ids).update(state=DataDay.State.RUNNING, lease_owner=WORKER_ID,
+                                              lease_expires=now + LEASE_TIME, modified=now)
+    return list(DataDay.objects.filter(id__in=ids).select_related("symbol"))
+
+
+def renew_leases():
+    return (DataDay.objects.filter(state=DataDay.State.RUNNING, lease_owner=WORKER_ID)
+            .update(lease_expires=timezone.now() + LEASE_TIME))
+
+
+def release_expired_leases():
+    count = (DataDay.objects.filter(state=DataDay.State.RUNNING, lease_expires__lt=timezone.now())
+             .update(state=DataDay.State.PENDING, lease_owner=None, lease_expires=None, modified=timezone.now()))
+    if count:
+        logging.info(f"Released {count} expired leases")
+    return count
+
+
+def heartbeat(stop):
+    while not stop.wait(HEARTBEAT_INTERVAL.total_seconds()):
+        try:
+            renew_leases()
+        except Exception:
+            logging.exception("Exception renewing leases")
+        finally:
+            django.db.close_old_connections()
+
+
 def get_day(day):
     logging.info(f"Getting {day}")
     try:
@@ -203,40 +312,123 @@ def get_day(day):
         logging.info(f"Got {day}")
     except Exception:
         logging.exception(f"Exception getting {day}")
-        day.last_tried = timezone.now()
-        day.save()
+        day_failed(day)
+    finally:
+        django.db.close_old_connections()
+
+
+def day_failed(day):
+    # Back to PENDING to be retried after RETRY_WAIT_TIME
+    (DataDay.objects.filter(id=day.id, state=DataDay.State.RUNNING, lease_owner=WORKER_ID)
+     .update(state=DataDay.State.PENDING, last_tried=timezone.now(), lease_owner=None, lease_expires=None,
+             modified=timezone.now()))
 
 
-def update_outstanding_days_parallel(days_to_get):
+def fetch_stage(day, _):
+    # Days already worked out as an index constituent aren't fetched again
+    try:
+        stored = stored_constituent_days([day.symbol.symbol], day.day).get(day.symbol.symbol)
+    finally:
+        django.db.close_old_connections()
+
+    if stored is not None:
+        return stored, None
+    return None, fetch_stock_day(day.symbol.symbol, day.day)
+
+
+def compute_stage(day, fetched):
+    stored, fetched = fetched
+    try:
+        if stored is None:
+            stored = compute_stock_day(day.symbol.symbol, fetched)
+        data = [Minute.from_minute_data(elem, day.symbol) for elem in stored]
+        return data, logic.rolling_correlations_for_day(day.symbol, day.day, data)
+    finally:
+        django.db.close_old_connections()
+
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
-        for day in days_to_get:
-            executor.submit(get_day, day)
+def store_stage(day, computed):
+    try:
+        store_day_data(day, *computed)
+    finally:
+        django.db.close_old_connections()
+
+
+def day_done(day):
+    logging.info(f"Got {day}")
 
 
-def update_outstanding_days(days_to_get):
+def day_pipeline_failed(day):
+    try:
+        day_failed(day)
+    finally:
+        django.db.close_old_connections()
 
-    if days_to_get:
-        logging.info(f"Pending: {len(days_to_get)} days")
 
-    for day in days_to_get:
-        get_day(day)
+def stock_pipeline():
+    # Stock days are fetched, computed and stored by separate pools of
+    # threads joined by bounded queues, so fetching carries on while earlier
+    # days are computed and written
+    return pipeline.Pipeline([
+        pipeline.Stage("fetch", fetch_stage, FETCH_THREADS, FETCH_QUEUE_SIZE),
+        pipeline.Stage("compute", compute_stage, COMPUTE_THREADS, COMPUTE_QUEUE_SIZE),
+        pipeline.Stage("store", store_stage, STORE_THREADS, STORE_QUEUE_SIZE),
+    ], on_done=day_done, on_error=day_pipeline_failed)
 
 
 def run():
-    while True:
-        stocks_to_get = get_outstanding_days(Symbol.Type.STOCK)
-        indices_to_get = get_outstanding_days(Symbol.Type.INDEX)
+    # Index days fetch their constituents in a nested pool
+    api.configure_session(FETCH_THREADS + INDEX_DAYS * NUM_INDEX_THREADS)
+
+    stop = threading.Event()
+    threading.Thread(target=heartbeat, args=(stop,), daemon=True).start()
+    logging.info(f"Backfill worker {WORKER_ID}")
 
-        if stocks_to_get or indices_to_get:
-            logging.info(f"Pending: {len(stocks_to_get)} stocks")
-            update_outstanding_days_parallel(stocks_to_get)
+    stocks = stock_pipeline()
+    stocks.start()
+    last_stats = time.monotonic()
 
-            logging.info(f"Pending: {len(indices_to_get)} indices")
-            update_outstanding_days_parallel(indices_to_get)
+    # Index days run alongside the stock pipeline; their constituents are
+    # fetched as they are needed, so they don't wait for stock days
+    indices = concurrent.futures.ThreadPoolExecutor(max_workers=INDEX_DAYS)
+    running_indices = set()
 
-        else:
-            time.sleep(SLEEP_TIME.total_seconds())
+    try:
+        while True:
+            if time.monotonic() - last_stats >= STATS_INTERVAL.total_seconds():
+                stocks.log_stats()
+                last_stats = time.monotonic()
+
+            release_expired_leases()
+
+            # Only claim as many days as there is room for so leases are not
+            # held by days waiting in this process
+            free = stocks.free()
+            stocks_to_get = claim_days(Symbol.Type.STOCK, free) if free else []
+            if stocks_to_get:
+                logging.info(f"Claimed: {len(stocks_to_get)} stocks")
+                for day in stocks_to_get:
+                    stocks.put(day)
+
+            running_indices = {future for future in running_indices if not future.done()}
+            free = INDEX_DAYS - len(running_indices)
+            indices_to_get = claim_days(Symbol.Type.INDEX, free) if free else []
+            if indices_to_get:
+                logging.info(f"Claimed: {len(indices_to_get)} indices")
+                for day in indices_to_get:
+                    running_indices.add(indices.submit(get_day, day))
+
+            if not stocks_to_get and not indices_to_get:
+                if stocks.in_flight or running_indices:
+                    time.sleep(PIPELINE_POLL_TIME.total_seconds())
+                else:
+                    time.sleep(SLEEP_TIME.total_seconds())
+    finally:
+        stop.set()
+        indices.shutdown()
+        stocks.stop()
+        if _compute_pool is not None:
+            _compute_pool.shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,91 @@
+import csv
+import logging
+import time
+
+from django.db import connection, transaction
+
+
+# Bytes read from the row stream per write to the connection
+COPY_BUFFER_SIZE = 64 * 1024
+
+# Fields identifying a row, used to skip rows that are already stored
+MINUTE_KEY = ["symbol", "time"]
+ROLLING_CORRELATION_KEY = ["symbol", "data_type", "window", "time"]
+
+
+class CsvStream:
+    # File-like object that renders rows as CSV on demand for copy_expert
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = ""
+        self.count = 0
+
+    def write(self, value):
+        self.buffer += value
+
+    def read(self, size=-1):
+        writer = csv.writer(self)
+        while size < 0 or len(self.buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            writer.writerow(row)
+            self.count += 1
+
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def copy_fields(model):
+    # Every stored column except an automatic primary key
+    return [field for field in model._meta.concrete_fields
+            if not (field.primary_key and field.get_internal_type() in ("AutoField", "BigAutoField"))]
+
+
+def object_rows(objs, fields):
+    for obj in objs:
+        yield [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields]
+
+
+@transaction.atomic
+def copy_objects(objs, key_fields=None):
+    # Insert model instances with COPY. With key_fields, rows go through a
+    # staging table and any whose key already exists are skipped.
+    if not objs:
+        return 0
+
+    model = type(objs[0])
+    table = model._meta.db_table
+    fields = copy_fields(model)
+    columns = [connection.ops.quote_name(field.column) for field in fields]
+    column_list = ", ".join(columns)
+    stream = CsvStream(object_rows(objs, fields))
+
+    start = time.perf_counter()
+    with connection.cursor() as cursor:
+        if key_fields is None:
+            cursor.copy_expert(f"COPY {table} ({column_list}) FROM STDIN WITH (FORMAT csv)", stream, size=COPY_BUFFER_SIZE)
+            count = stream.count
+        else:
+            staging = connection.ops.quote_name(f"staging_{table}")
+            keys = [connection.ops.quote_name(model._meta.get_field(name).column) for name in key_fields]
+            matches = " AND ".join(f"t.{key} = s.{key}" for key in keys)
+
+            cursor.execute(f"CREATE TEMPORARY TABLE IF NOT EXISTS {staging} AS SELECT {column_list} FROM {table} WITH NO DATA")
+            cursor.execute(f"TRUNCATE {staging}")
+            cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)", stream, size=COPY_BUFFER_SIZE)
+            cursor.execute(f"""
+                INSERT INTO {table} ({column_list})
+                SELECT DISTINCT ON ({", ".join(f"s.{key}" for key in keys)}) {", ".join(f"s.{column}" for column in columns)}
+                FROM {staging} s
+                WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE {matches})
+            """)
+            count = cursor.rowcount
+
+    seconds = time.perf_counter() - start
+    logging.info(f"Copied {count}/{stream.count} rows into {table} in {seconds:.2f}s "
+                 f"({stream.count / seconds if seconds else 0:.0f} rows/s)")
+    return count
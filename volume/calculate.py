@@ -1,12 +1,18 @@
 import csv
 import datetime
+import itertools
 import math
+import operator
 
 import numpy
 
 from .models import RollingCorrelation
 
 
+FIXED_POINT_SCALE = 10**4
+MINUTE_NANOS = 60 * 10**9
+
+
 def calc_mid(quote):
     return (quote["bid_price"] + quote["ask_price"]) / 2
 
@@ -20,59 +26,95 @@ def weighted_volume(weights, values):
     return volume
 
 
-def calculate(quotes, trades, mid):
-    total_volume = 0
-    # print(len(quote_response.json()["results"]))
+def quote_arrays(quotes):
+    # Quotes missing a bid or ask get a NaN price and are never used as a mid
+    count = len(quotes)
+    times = numpy.fromiter((q["sip_timestamp"] for q in quotes), dtype=numpy.int64, count=count)
+    bids = numpy.fromiter((q.get("bid_price", math.nan) for q in quotes), dtype=numpy.float64, count=count)
+    asks = numpy.fromiter((q.get("ask_price", math.nan) for q in quotes), dtype=numpy.float64, count=count)
+    return times, bids, asks
+
+
+def trade_arrays(trades):
+    # Trades without a size are fictitious and are dropped
+    trades = [t for t in trades if "size" in t]
+    count = len(trades)
+    times = numpy.fromiter((t["sip_timestamp"] for t in trades), dtype=numpy.int64, count=count)
+    prices = numpy.fromiter((t["price"] for t in trades), dtype=numpy.float64, count=count)
+    sizes = numpy.fromiter((int(t["size"]) for t in trades), dtype=numpy.int64, count=count)
+    return times, prices, sizes
+
+
+def calculate_arrays(quote_times, bids, asks, trade_times, prices, sizes, mid):
+    mids = (bids + asks) / 2
+    valid = ~numpy.isnan(mids)
+    valid_times = quote_times[valid]
+    valid_mids = mids[valid]
+
+    # Index of the last valid quote at or before each trade
+    idx = numpy.searchsorted(valid_times, trade_times, side="right") - 1
+    has_quote = idx >= 0
+
+    signs = numpy.sign(prices[has_quote] - valid_mids[idx[has_quote]]).astype(numpy.int64)
+    total_volume = int(numpy.dot(signs, sizes[has_quote]))
 
+    # Trades before the first valid quote use the mid carried in, which may
+    # be a Decimal, so compare them exactly as Python does
+    for trade_price, volume in zip(prices[~has_quote].tolist(), sizes[~has_quote].tolist()):
+        if trade_price > mid:
+            total_volume += volume
+        elif trade_price < mid:
+            total_volume -= volume
+
+    return total_volume
+
+
+def calculate(quotes, trades, mid):
     if quotes:
         last_mid = calc_mid(quotes[-1])
-        quotes = iter(quotes)
-        next_quote = next(quotes)
-        next_time = next_quote["sip_timestamp"]
     else:
         last_mid = mid
 
-    for trade in trades:
+    total_volume = calculate_arrays(*quote_arrays(quotes), *trade_arrays(trades), mid)
 
-        if "size" not in trade:
-            # A fictitious trade
-            continue
+    return total_volume, last_mid
 
-        trade_time = trade["sip_timestamp"]
-        # print(f"\t\t{trade_time}")
 
-        if quotes:
-            while next_quote is not None and next_time <= trade_time:
-                try:
-                    next_mid = calc_mid(next_quote)
-                    quote = next_quote
-                    quote_time = next_time
-                    mid = next_mid
-                    # print(f"Skip to \t{quote_time}")
+def day_trade_arrays(trades):
+    # Unlike trade_arrays, trades without a size are kept with a size of zero
+    # so they still count as the last price of their minute
+    count = len(trades)
+    times = numpy.fromiter((t["sip_timestamp"] for t in trades), dtype=numpy.int64, count=count)
+    prices = numpy.fromiter((t["price"] for t in trades), dtype=numpy.float64, count=count)
+    sizes = numpy.fromiter((int(t.get("size", 0)) for t in trades), dtype=numpy.int64, count=count)
+    return times, prices, sizes
 
-                except KeyError:
-                    # Either bid or ask is missing
-                    pass
 
-                try:
-                    next_quote = next(quotes)
-                    next_time = next_quote["sip_timestamp"]
-                except StopIteration:
-                    next_quote = None
-                # print("End of quotes")
+def minute_arrays(minute_times, quote_times, bids, asks, trade_times, prices, sizes, mid):
+    # Per-minute values for a whole day of ticks sorted by time. minute_times
+    # holds the start of each minute in nanoseconds and mid is the mid before
+    # the first quote. Only arrays go in and out so this can run in another
+    # process. Returns volume, cumulative volume, last price (NaN before the
+    # first trade), last mid and cumulative slope for each minute.
+    mids = (bids + asks) / 2
+    valid = ~numpy.isnan(mids)
+    valid_times = quote_times[valid]
+    valid_mids = numpy.concatenate(([mid], mids[valid]))
 
-        # assert quote_time <= trade_time
-        # assert next_time > trade_time
+    # Mid of the last valid quote at or before each trade, or the mid carried in
+    trade_mids = valid_mids[numpy.searchsorted(valid_times, trade_times, side="right")]
+    signed = numpy.sign(prices - trade_mids).astype(numpy.int64) * sizes
 
-        trade_price = trade["price"]
-        volume = int(trade["size"])
+    trade_minutes = numpy.searchsorted(minute_times, trade_times, side="right") - 1
+    volumes = numpy.zeros(len(minute_times), dtype=numpy.int64)
+    numpy.add.at(volumes, trade_minutes, signed)
 
-        if trade_price > mid:
-            total_volume += volume
-        elif trade_price < mid:
-            total_volume -= volume
+    # Last trade and last quote before the end of each minute, carried forward
+    ends = minute_times + MINUTE_NANOS
+    lasts = numpy.concatenate(([math.nan], prices))[numpy.searchsorted(trade_times, ends)]
+    last_mids = valid_mids[numpy.searchsorted(valid_times, ends)]
 
-    return total_volume, last_mid
+    return volumes, numpy.cumsum(volumes), lasts, last_mids, numpy.cumsum(numpy.sign(volumes))
 
 
 def last_price(trades):
@@ -111,26 +153,6 @@ def correlation(a, b):
     return numpy.corrcoef(a, b)[0, 1]
 
 
-def volume_correlation(day_data):
-    prices = [float(d.last) for d in day_data]
-    volumes = [float(d.cumulative_volume) for d in day_data]
-
-    if not prices or not volumes:
-        raise ValueError
-
-    return correlation(prices, volumes)
-
-
-def slope_correlation(day_data):
-    prices = [float(d.last) for d in day_data]
-    slopes = [d.slope for d in day_data]
-
-    if not prices or not slopes:
-        raise ValueError
-
-    return correlation(prices, slopes)
-
-
 def update_online_correlation(correlation, x, y):
     if x is None or y is None:
         return
@@ -154,18 +176,142 @@ def update_online_correlation(correlation, x, y):
     correlation.n += 1
 
 
-def rolling_correlation(minute, data, data_type, window):
-    window_interval = datetime.timedelta(minutes=window)
-    start = minute - window_interval
-    rolling_data = [m for m in data if start < m.time <= minute]
-
-    if len(rolling_data) != window:
-        return None
-
-    prices = [float(m.last) for m in rolling_data]
-    if data_type == RollingCorrelation.DataType.VOLUME:
-        values = [float(m.cumulative_volume) for m in rolling_data]
-    else:
-        values = [m.slope for m in rolling_data]
-
-    return correlation(prices, values)
+def to_fixed(value):
+    # Exact integer in units of FIXED_POINT_SCALE, matching DecimalField(decimal_places=4)
+    return round(value * FIXED_POINT_SCALE)
+
+
+def prefix_sums(values):
+    return [0, *itertools.accumulate(values)]
+
+
+class RollingCorrelationSums:
+    # Prefix sums over a day's minutes for price against volume or slope.
+    # Sums are kept as exact integers so windows with a constant series give
+    # NaN just as numpy.corrcoef does, rather than rounding noise.
+
+    def __init__(self, data, data_type):
+        data = sorted(data, key=operator.attrgetter("time"))
+        self.times = [m.time for m in data]
+
+        xs = []
+        ys = []
+        missing = []
+        for m in data:
+            if data_type == RollingCorrelation.DataType.VOLUME:
+                y = m.cumulative_volume
+            else:
+                y = m.slope
+
+            if m.last is None or y is None:
+                xs.append(0)
+                ys.append(0)
+                missing.append(1)
+            else:
+                xs.append(to_fixed(m.last))
+                ys.append(to_fixed(y))
+                missing.append(0)
+
+        self.x = prefix_sums(xs)
+        self.y = prefix_sums(ys)
+        self.xx = prefix_sums(x*x for x in xs)
+        self.yy = prefix_sums(y*y for y in ys)
+        self.xy = prefix_sums(x*y for x, y in zip(xs, ys))
+        self.missing = prefix_sums(missing)
+
+    def is_full(self, start, end, window):
+        # The window must hold exactly one minute for each of its minutes
+        span = self.times[end - 1] - self.times[start]
+        return (span == datetime.timedelta(minutes=window - 1) and
+                self.missing[end] == self.missing[start])
+
+    def correlation(self, start, end):
+        n = end - start
+        sx = self.x[end] - self.x[start]
+        sy = self.y[end] - self.y[start]
+        sxx = self.xx[end] - self.xx[start]
+        syy = self.yy[end] - self.yy[start]
+        sxy = self.xy[end] - self.xy[start]
+
+        covariance = n*sxy - sx*sy
+        x_variance = n*sxx - sx*sx
+        y_variance = n*syy - sy*sy
+
+        if x_variance == 0 or y_variance == 0:
+            return math.nan
+
+        r = covariance / (math.sqrt(x_variance) * math.sqrt(y_variance))
+        return max(-1.0, min(1.0, r))
+
+    def series(self, window):
+        results = []
+        for end in range(window, len(self.times) + 1):
+            start = end - window
+            if self.is_full(start, end, window):
+                results.append((self.times[end - 1], self.correlation(start, end)))
+
+        return results
+
+
+def rolling_correlations(data, data_type, window):
+    return RollingCorrelationSums(data, data_type).series(window)
+
+
+def lttb(x, y, threshold):
+    # Indices of the points kept by Largest-Triangle-Three-Buckets. The first
+    # and last points are kept and one point is picked from each bucket in
+    # between, the one forming the largest triangle with the previous pick
+    # and the average of the next bucket.
+    n = len(x)
+    if threshold >= n:
+        return numpy.arange(n)
+    if threshold < 3:
+        return numpy.array([0, n - 1])
+
+    edges = numpy.linspace(1, n - 1, threshold - 1).astype(numpy.int64)
+    counts = numpy.diff(edges)
+    avg_x = numpy.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    avg_y = numpy.add.reduceat(y[:n - 1], edges[:-1]) / counts
+
+    kept = numpy.empty(threshold, dtype=numpy.int64)
+    kept[0] = 0
+    kept[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 1 < threshold - 2:
+            next_x, next_y = avg_x[i + 1], avg_y[i + 1]
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        areas = numpy.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(numpy.argmax(areas))
+        kept[i + 1] = a
+
+    return kept
+
+
+def downsample(x, y, points):
+    # Indices to plot roughly `points` points of y against x. Each run of
+    # finite values is reduced with LTTB in proportion to its length, and the
+    # first NaN of each gap is kept so chart lines still break between days.
+    n = len(y)
+    if n <= points:
+        return numpy.arange(n)
+
+    finite = numpy.isfinite(y)
+    changes = numpy.flatnonzero(numpy.diff(finite.astype(numpy.int8))) + 1
+    bounds = [0, *changes.tolist(), n]
+    runs = sum(1 for start in bounds[:-1] if finite[start])
+    total = int(finite.sum())
+    budget = max(points - runs, 2 * runs)
+
+    indices = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if finite[start]:
+            share = max(2, round(budget * (end - start) / total))
+            indices.append(start + lttb(x[start:end], y[start:end], share))
+        else:
+            indices.append(numpy.array([start]))
+
+    return numpy.concatenate(indices)
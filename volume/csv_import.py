@@ -1,9 +1,12 @@
 import csv
 import datetime
+import functools
 
 from django.db import transaction
 from django.utils import timezone
 
+from . import bulk
+from . import day_cache
 from .models import Symbol, DataDay, Minute
 
 
@@ -29,8 +32,9 @@ def save_data(minutes, days):
         if not created:
             dd.state = DataDay.State.COMPLETE
             dd.save()
+        transaction.on_commit(functools.partial(day_cache.invalidate, symbol.symbol, date))
 
-    Minute.objects.bulk_create(minutes)
+    bulk.copy_objects(minutes, bulk.MINUTE_KEY)
 
 
 def load_from_csv(path):
@@ -0,0 +1,112 @@
+import os
+import threading
+import urllib.parse
+from pathlib import Path
+
+import numpy
+from django.conf import settings
+
+
+# Minute data for COMPLETE days never changes, so it is kept on disk as one
+# memory-mapped .npy per (symbol, day, fields). Column 0 holds the minute as
+# epoch seconds and the remaining columns the fields, with NaN for nulls.
+
+_lock = threading.Lock()
+# Bytes in the cache as of the last scan plus what this process has written
+# since, or None before the first scan
+_size = None
+
+
+def cache_dir():
+    return Path(settings.DAY_CACHE_DIR)
+
+
+def day_dir(symbol, day):
+    return cache_dir() / urllib.parse.quote(symbol, safe="") / f"{day:%F}"
+
+
+def path_for(symbol, day, fields):
+    return day_dir(symbol, day) / ("-".join(fields) + ".npy")
+
+
+def get(symbol, day, fields):
+    path = path_for(symbol, day, fields)
+    try:
+        data = numpy.load(path, mmap_mode="r")
+        os.utime(path)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    return data[:, 0].astype(numpy.int64), data[:, 1:]
+
+
+def put(symbol, day, fields, times, values):
+    # Callers should call evict_if_full once they are done writing
+    global _size
+    path = path_for(symbol, day, fields)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    data = numpy.empty((len(times), len(fields) + 1), dtype=numpy.float64)
+    data[:, 0] = times
+    data[:, 1:] = values
+
+    # Write then rename so readers never see a partial file
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with tmp_path.open("wb") as f:
+        numpy.save(f, data)
+    os.replace(tmp_path, path)
+
+    size = path.stat().st_size
+    with _lock:
+        if _size is not None:
+            _size += size
+    return size
+
+
+def invalidate(symbol, day):
+    global _size
+    directory = day_dir(symbol, day)
+    with _lock:
+        for path in directory.glob("*.npy"):
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            if _size is not None:
+                _size -= size
+
+
+def evict_if_full(max_bytes=None):
+    if max_bytes is None:
+        max_bytes = settings.DAY_CACHE_MAX_BYTES
+
+    with _lock:
+        size = _size
+    if size is None or size > max_bytes:
+        evict(max_bytes)
+
+
+def evict(max_bytes=None):
+    # Drop the least recently used files until the cache fits
+    global _size
+    if max_bytes is None:
+        max_bytes = settings.DAY_CACHE_MAX_BYTES
+
+    with _lock:
+        files = []
+        for path in cache_dir().glob("*/*/*.npy"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+        _size = total
@@ -1,23 +1,31 @@
 import concurrent.futures
+import dataclasses
 import datetime
-import functools
 import itertools
 import logging
 import threading
+import time
 from collections import defaultdict
 
+import django.db
 from django.utils import timezone
 
 from . import api
+from . import bulk
 from . import calculate
 from . import logic
 from . import market
 from . import ws
-from .models import Symbol, Minute, DataDay, MinuteData, IndexWeight, IncomingPrice, Correlation, Group, RollingCorrelation
+from .models import Symbol, Minute, DataDay, MinuteData, Correlation, Group
 
 
 NUM_THREADS = 6
 
+# Wait this long after each minute boundary for the API data to settle
+TICK_OFFSET = datetime.timedelta(seconds=5)
+# Keep ticking this long after the close to fill any missed minutes
+CLOSE_GRACE = datetime.timedelta(minutes=5)
+
 CORRELATION_MINIMUM_DATA_POINTS_BEFORE_SEND = 15
 
 
@@ -40,69 +48,182 @@ def day_complete(symbol, day):
     return existing_data.count() == market.count_minutes_in_trading_day()
 
 
-def incoming_data(symbol, minute, symbol_obj=None):
+class LiveState:
+    # The last computed minute for each symbol, held by the live process so
+    # cumulative values carry forward without a DB lookup every minute
 
-    if market.is_opening_minute(minute):
-        cumulative_volume = 0
-        cumulative_slope = 0
-        if symbol_obj and symbol_obj.is_index:
-            last_mid = 0
-        else:
-            last_mid = api.mid_last(symbol, minute)
-        write_back = symbol_obj is None
-
-    elif symbol_obj is not None:
-        write_back = False
-        try:
-            last = logic.minute_before(symbol, minute)
-            last_mid = last.last_mid_before
-            cumulative_volume = last.cumulative_volume
-            cumulative_slope = last.slope
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.minutes = {}
+        self.mids = {}
+
+    def seed(self, symbols, day):
+        # Load the latest stored minute for each symbol in one query
+        latest = (Minute.timescale.filter(symbol__in=symbols, time__range=logic.day_to_range(day))
+                  .order_by("symbol_id", "-time")
+                  .distinct("symbol_id")
+                  .select_related("symbol"))
+
+        with self.lock:
+            for minute_obj in latest:
+                current = self.minutes.get(minute_obj.symbol.symbol)
+                if current is None or current.time < minute_obj.time:
+                    self.minutes[minute_obj.symbol.symbol] = minute_obj.to_minute_data()
+
+    def previous_minute(self, symbol, minute):
+        previous = minute - market.ONE_MINUTE
+
+        with self.lock:
+            minute_data = self.minutes.get(symbol)
+
+        if minute_data is not None and minute_data.time == previous:
+            return minute_data
+
+        # Gap or fresh start: fall back to the DB
+        minute_data = logic.minute_before(symbol, minute).to_minute_data(symbol)
+        with self.lock:
+            self.minutes[symbol] = minute_data
+        return minute_data
+
+    def previous_mid(self, symbol, minute):
+        previous = minute - market.ONE_MINUTE
+
+        with self.lock:
+            time, mid = self.mids.get(symbol, (None, None))
+            minute_data = self.minutes.get(symbol)
+
+        if time == previous:
+            return mid
+        if minute_data is not None and minute_data.time == previous:
+            return minute_data.last_mid_before
+        return None
+
+    def update(self, minute_data, tracked):
+        with self.lock:
+            if minute_data.last_mid_before is not None:
+                self.mids[minute_data.symbol] = (minute_data.time, minute_data.last_mid_before)
+            if tracked:
+                self.minutes[minute_data.symbol] = minute_data
+
+    def forget(self, symbols):
+        # Drop carried values that were never stored so the next tick reads
+        # them back from the DB
+        with self.lock:
+            for symbol in symbols:
+                self.minutes.pop(symbol, None)
+                self.mids.pop(symbol, None)
+
+
+live_state = LiveState()
+
+
+class TickCache:
+    # Minutes computed during one live tick, keyed by (symbol, minute) so the
+    # stock and index paths share them. Concurrent requests for the same key
+    # wait for the first caller rather than fetching again.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.futures = {}
+
+    def clear(self):
+        with self.lock:
+            self.futures = {}
+
+    def get(self, symbol, minute, compute):
+        key = (symbol, minute)
+
+        with self.lock:
+            future = self.futures.get(key)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self.futures[key] = future
+
+        if owner:
+            try:
+                future.set_result(compute(symbol, minute))
+            except Exception as e:
+                # Let a later caller in the tick try again
+                with self.lock:
+                    del self.futures[key]
+                future.set_exception(e)
+
+        return future.result()
 
-            if cumulative_volume is None:
-                raise ValueError
 
+tick_cache = TickCache()
+
+
+def incoming_mid(symbol, minute):
+    if not market.is_opening_minute(minute):
+        last_mid = live_state.previous_mid(symbol, minute)
+        if last_mid is not None:
+            return last_mid
+
+        try:
+            last_mid = live_state.previous_minute(symbol, minute).last_mid_before
+            if last_mid is not None:
+                return last_mid
         except Minute.DoesNotExist:
-            logging.error(f"Last minute DNE for {symbol.symbol} at {minute}")
-            raise ValueError
+            pass
+
+    return api.mid_last(symbol, minute)
 
-    else:
-        write_back = True
-        cumulative_volume = 0
-        cumulative_slope = 0
-        incoming = logic.incoming_price_for(symbol, minute)
-        if incoming is not None:
-            last_mid = incoming.last_mid_before
-        else:
-            last_mid = api.mid_last(symbol, minute)
 
-    return cumulative_volume, last_mid, cumulative_slope, write_back
+def incoming_cumulative(symbol, minute):
+    if market.is_opening_minute(minute):
+        return 0, 0
 
+    try:
+        last = live_state.previous_minute(symbol, minute)
+    except Minute.DoesNotExist:
+        logging.error(f"Last minute DNE for {symbol} at {minute}")
+        raise ValueError
 
-@functools.lru_cache(maxsize=250)
-def stock_for_minute(symbol, minute, symbol_obj=None):
+    if last.cumulative_volume is None:
+        raise ValueError
 
-    cumulative_volume, last_mid, cumulative_slope, write_back = incoming_data(symbol, minute, symbol_obj)
+    return last.cumulative_volume, last.slope
+
+
+def compute_minute(symbol, minute):
+    last_mid = incoming_mid(symbol, minute)
 
     trade = api.trade_minute(symbol, minute)
     quote = api.quote_minute(symbol, minute)
 
     volume, last_mid = calculate.calculate(quote, trade, last_mid)
-    cumulative_volume += volume
     last = calculate.last_price(trade)
     slope = calculate.calculate_slope(volume)
-    cumulative_slope += slope
 
-    logging.info(f"{symbol}\t{minute}\t{volume}\t{cumulative_volume}\t{last_mid}\t{slope}\t{cumulative_slope}")
+    minute_data = MinuteData(minute, symbol, last, volume, volume, last_mid, slope)
+    live_state.update(minute_data, tracked=False)
+    return minute_data
+
+
+def stock_for_minute(symbol, minute, symbol_obj=None):
+    # Without a Symbol the minute is an index constituent and only its
+    # volume is used, so nothing is carried over from the previous minute
+    minute_data = tick_cache.get(symbol, minute, compute_minute)
+    if symbol_obj is None:
+        return minute_data
+
+    cumulative_volume, cumulative_slope = incoming_cumulative(symbol, minute)
+    cumulative_volume += minute_data.volume
+    cumulative_slope += minute_data.slope
 
-    if write_back:
-        IncomingPrice.objects.create(symbol=symbol, time=minute, last_mid_before=last_mid)
+    logging.info(f"{symbol}\t{minute}\t{minute_data.volume}\t{cumulative_volume}\t{minute_data.last_mid_before}\t{minute_data.slope}\t{cumulative_slope}")
 
-    return MinuteData(minute, symbol, last, volume, cumulative_volume, last_mid, cumulative_slope)
+    minute_data = dataclasses.replace(minute_data,
+                                      cumulative_volume=cumulative_volume,
+                                      slope=cumulative_slope)
+    live_state.update(minute_data, tracked=True)
+    return minute_data
 
 
 def index_for_minute(symbol, minute, existing, executor, symbol_obj):
-    cumulative_volume, _, cumulative_slope, _ = incoming_data(symbol, minute, symbol_obj)
+    cumulative_volume, cumulative_slope = incoming_cumulative(symbol, minute)
 
     weights = logic.weights(symbol_obj)
     all_symbols = set(weights.keys())
@@ -110,8 +231,8 @@ def index_for_minute(symbol, minute, existing, executor, symbol_obj):
     needed = all_symbols - existing_set
 
     futures = []
-    for symbol in needed:
-        fut = executor.submit(stock_for_minute, symbol, minute)
+    for constituent in needed:
+        fut = executor.submit(stock_for_minute, constituent, minute)
         futures.append(fut)
 
     for future in concurrent.futures.as_completed(futures):
@@ -127,7 +248,9 @@ def index_for_minute(symbol, minute, existing, executor, symbol_obj):
     if not last:
         logging.warning(f"No index value for {symbol_obj.name}")
 
-    return MinuteData(minute, symbol, last, volume, cumulative_volume, None, cumulative_slope)
+    minute_data = MinuteData(minute, symbol, last, volume, cumulative_volume, None, cumulative_slope)
+    live_state.update(minute_data, tracked=True)
+    return minute_data
 
 
 def run_for_symbol(symbol, existing, executor, day=None, limit=None):
@@ -136,36 +259,64 @@ def run_for_symbol(symbol, existing, executor, day=None, limit=None):
     if day is None:
         day = timezone.localdate()
 
-    dataday = get_or_create_dataday(symbol, day)
+    get_or_create_dataday(symbol, day)
     missing = logic.missing_minutes(symbol, day)
     if limit is not None:
         missing = missing[:limit]
 
     for minute in missing:
-        if symbol.type == Symbol.Type.STOCK:
-            minute_data = stock_for_minute(symbol.symbol, minute, symbol)
-            minute_obj = Minute.from_minute_data(minute_data, symbol)
-            symbol_data[minute][symbol.symbol] = minute_obj
-
-        elif symbol.type == Symbol.Type.INDEX:
-            minute_data = index_for_minute(symbol.symbol,
-                                           minute,
-                                           existing[minute],
-                                           executor,
-                                           symbol)
-            minute_obj = Minute.from_minute_data(minute_data, symbol)
-            symbol_data[minute][symbol.symbol] = minute_obj
-
-        minute_obj.save()
-        ws.send_minute(minute_obj)
-
-        if market.is_closing_minute(minute) and day_complete(symbol, day):
-            dataday.state = DataDay.State.COMPLETE
-            dataday.save()
+        # Keep the minutes computed so far; the rest are retried next tick
+        try:
+            if symbol.type == Symbol.Type.STOCK:
+                minute_data = stock_for_minute(symbol.symbol, minute, symbol)
+
+            elif symbol.type == Symbol.Type.INDEX:
+                minute_data = index_for_minute(symbol.symbol,
+                                               minute,
+                                               existing[minute],
+                                               executor,
+                                               symbol)
+        except Exception:
+            logging.exception(f"Exception getting {symbol.symbol} at {minute}")
+            break
+
+        minute_obj = Minute.from_minute_data(minute_data, symbol)
+        symbol_data[minute][symbol.symbol] = minute_obj
 
     return symbol_data
 
 
+def minute_objects(symbol_data):
+    return [minute_obj
+            for minute_data in symbol_data.values()
+            for minute_obj in minute_data.values()]
+
+
+def store_minutes(minute_objs, day, publisher):
+    # Returns the symbols whose day is now complete
+    if not minute_objs:
+        return []
+
+    try:
+        bulk.copy_objects(minute_objs, bulk.MINUTE_KEY)
+    except Exception:
+        live_state.forget({minute_obj.symbol.symbol for minute_obj in minute_objs})
+        raise
+
+    for minute_obj in minute_objs:
+        publisher.add_minute(minute_obj)
+
+    closing = set(minute_obj.symbol for minute_obj in minute_objs
+                  if market.is_closing_minute(minute_obj.time))
+    completed = []
+    for symbol_obj in closing:
+        if day_complete(symbol_obj, day):
+            DataDay.objects.filter(symbol=symbol_obj, day=day).update(state=DataDay.State.COMPLETE, modified=timezone.now())
+            completed.append(symbol_obj)
+
+    return completed
+
+
 def missing_index_minutes(index, day=None):
     if day is None:
         day = timezone.localdate()
@@ -184,34 +335,28 @@ def update_data(all_data, update):
         all_data[minute].update(minute_data)
 
 
-def update_rolling_correlations(symbol_obj, day, data_type):
-    missing = logic.missing_rolling_correlation_minutes(symbol_obj, day, data_type)
-    if not missing:
-        return
-    earliest = missing[0]
+def rolling_correlations_for_symbol(symbol_obj, day):
+    missing = logic.all_missing_rolling_correlation_minutes(symbol_obj, day)
+    if not any(missing.values()):
+        return []
+    earliest = min(minutes[0] for minutes in missing.values() if minutes)
     _, end = logic.day_to_range(day)
     start = earliest - logic.ROLLING_CORRELATION_INTERVAL
 
     data = Minute.timescale.filter(symbol=symbol_obj, time__range=(start, end))
 
-    for minute in missing:
-        try:
-            corr = calculate.rolling_correlation(minute, data, data_type, logic.ROLLING_CORRELATION_WINDOW)
-        except (TypeError, ValueError):
-            corr = None
-            # logging.warning(f"Problem calculating rolling correlations for {symbol_obj.symbol}")
-        if corr is None:
-            continue
+    return logic.rolling_correlation_objects(symbol_obj, data, missing)
+
+
+def update_rolling_correlations(symbol_objs, day, publisher):
+    rolls = []
+    for symbol_obj in symbol_objs:
+        rolls += rolling_correlations_for_symbol(symbol_obj, day)
 
-        roll = RollingCorrelation(
-            time=minute,
-            symbol=symbol_obj,
-            data_type=data_type,
-            window=logic.ROLLING_CORRELATION_WINDOW,
-            value=corr)
+    bulk.copy_objects(rolls, bulk.ROLLING_CORRELATION_KEY)
 
-        roll.save()
-        ws.send_rolling_correlation(roll)
+    for roll in rolls:
+        publisher.add_rolling_correlation(roll)
 
 
 def update_correlations(symbol_data, day, data_type):
@@ -283,56 +428,138 @@ def push_slope_tables():
         ws.send_slope_table(group)
 
 
-def run(day=None, limit=None, threads=None, skip_indices=False):
-    if day is None:
-        day = timezone.localdate()
-
+def active_symbols(skip_indices=False):
     stocks = Symbol.objects.stocks(active=True)
     if skip_indices:
         indices = []
     else:
         indices = Symbol.objects.indices(active=True)
 
+    return stocks, indices
+
+
+def run_tick(executor, day, limit=None, skip_indices=False):
+    tick_cache.clear()
+    stocks, indices = active_symbols(skip_indices)
     all_data = defaultdict(dict)
+    publisher = ws.Publisher()
+
+    # Stocks
+    logging.info("Getting %d stocks", len(stocks))
+
+    futures = []
+    for symbol in stocks:
+        fut = executor.submit(run_for_symbol, symbol, all_data, executor, day, limit)
+        futures.append(fut)
+
+    new_minutes = []
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            symbol_data = future.result()
+            new_minutes += minute_objects(symbol_data)
+            update_data(all_data, symbol_data)
+
+        except Exception:
+            logging.exception(f"Exception resolving future")
+
+    # Store stocks before indices so they are not held back by constituent fetches
+    completed = store_minutes(new_minutes, day, publisher)
+    publisher.flush()
+
+    # Indices
+    if indices:
+        logging.info("Getting %d indices", len(indices))
+
+    new_minutes = []
+    for index in indices:
+        index_data = run_for_symbol(index, all_data, executor, day, limit=limit)
+        new_minutes += minute_objects(index_data)
+        update_data(all_data, index_data)
+
+    completed += store_minutes(new_minutes, day, publisher)
+
+    # Update correlations
+    if all_data:
+        update_rolling_correlations(itertools.chain(stocks, indices), day, publisher)
+        publisher.flush()
+
+        update_correlations(all_data, day, Correlation.DataType.VOLUME)
+        update_correlations(all_data, day, Correlation.DataType.SLOPE)
+        push_slope_tables()
+
+    # Summaries last so they include the final rolling correlations
+    if completed:
+        logic.update_day_summaries(completed, day, day)
+
+
+def run(day=None, limit=None, threads=None, skip_indices=False):
+    if day is None:
+        day = timezone.localdate()
 
     if threads is None:
         threads = NUM_THREADS
 
+    api.configure_session(threads)
+    stocks, indices = active_symbols(skip_indices)
+    live_state.seed(list(itertools.chain(stocks, indices)), day)
+
     with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        run_tick(executor, day, limit, skip_indices)
 
-        # Stocks
-        logging.info("Getting %d stocks", stocks.count())
+    # Let queued websocket messages go out before the process exits
+    if not ws.sender.wait(timeout=ws.DRAIN_TIMEOUT):
+        logging.warning(f"Websocket messages left unsent: {ws.sender.stats()}")
 
-        futures = []
-        for symbol in stocks:
-            fut = executor.submit(run_for_symbol, symbol, all_data, executor, day, limit)
-            futures.append(fut)
+    logging.info("Done")
 
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                symbol_data = future.result()
-                update_data(all_data, symbol_data)
 
-            except Exception:
-                logging.exception(f"Exception resolving future")
+def next_tick(now, offset=TICK_OFFSET):
+    boundary = now.replace(second=0, microsecond=0) + market.ONE_MINUTE
+    return boundary + offset
 
-        # Indices
-        if indices:
-            logging.info("Getting %d indices", indices.count())
 
-        for index in indices:
-            index_data = run_for_symbol(index, all_data, executor, day, limit=limit)
-            update_data(all_data, index_data)
+def is_live_time(now):
+    if not market.is_weekday(now.date()):
+        return False
 
-        # Update correlations
-        if all_data:
-            for symbol_obj in itertools.chain(stocks, indices):
-                update_rolling_correlations(symbol_obj, day, RollingCorrelation.DataType.VOLUME)
-                update_rolling_correlations(symbol_obj, day, RollingCorrelation.DataType.SLOPE)
+    market_open, market_close = market.open_close(now.date())
+    return market_open < now <= market_close + CLOSE_GRACE
 
-            update_correlations(all_data, day, Correlation.DataType.VOLUME)
-            update_correlations(all_data, day, Correlation.DataType.SLOPE)
-            push_slope_tables()
 
+def run_forever(offset=TICK_OFFSET, threads=None):
+    if threads is None:
+        threads = NUM_THREADS
 
-    logging.info("Done")
+    api.configure_session(threads)
+    seeded_day = None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        while True:
+            now = timezone.now()
+            tick = next_tick(now, offset)
+            time.sleep((tick - now).total_seconds())
+
+            django.db.close_old_connections()
+
+            now = timezone.now()
+            if not is_live_time(now) or logic.is_live_paused():
+                continue
+
+            day = timezone.localdate()
+            if day != seeded_day:
+                stocks, indices = active_symbols()
+                live_state.seed(list(itertools.chain(stocks, indices)), day)
+                seeded_day = day
+
+            start = time.monotonic()
+            try:
+                run_tick(executor, day)
+            except Exception:
+                logging.exception("Exception running live tick")
+            elapsed = time.monotonic() - start
+
+            remaining = (next_tick(now, offset) - timezone.now()).total_seconds()
+            stats = ws.sender.stats()
+            logging.info(f"Tick took {elapsed:.1f}s, {remaining:.1f}s left before the next. "
+                         f"Websocket queue {stats['depth']}, dropped {stats['dropped']}, failed {stats['failed']}")
+            logic.record_live_tick(elapsed)
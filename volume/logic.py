@@ -1,23 +1,46 @@
 import csv
 import datetime
 import io
+import itertools
+import logging
+import math
 import operator
 from collections import OrderedDict, defaultdict
 
 import django.db
+import numpy
 from django.db.models import Q
+from django.db.models.functions import TruncDate
 from django.utils import timezone
 
 from . import api
 from . import calculate
+from . import day_cache
 from . import market
-from .models import Symbol, DataDay, Minute, Chart, IncomingPrice, Correlation, Group, RollingCorrelation, MarketHoliday, SystemSetting
+from .models import Symbol, DataDay, Minute, Chart, IncomingPrice, Correlation, Group, RollingCorrelation, MarketHoliday, SystemSetting, DaySummary
+from .models import Minute5m, Minute15m, Minute1h, Minute1d
 
 
 DATA_HEADER = ["Symbol", "Date", "Minute UTC", "Last Trade", "Minute Volume", "Daily Volume", "Slope"]
+SUMMARY_HEADER = ["Symbol", "Date", "Open", "Close", "Low", "High", "Daily Volume", "Slope Change", "Volume Correlation", "Slope Correlation", "Minutes"]
+CSV_FIELDS = ("last", "volume", "cumulative_volume", "slope")
+CSV_DAYS_PER_QUERY = 20
+
+TRADING_MINUTES_PER_DAY = 390
+
+# Continuous aggregates of Minute, coarsest first, as (model, bucket width in
+# trading minutes, offset from the bucket start to the last minute it holds).
+# Buckets are placed at that minute so they line up with minute data.
+ROLLUPS = (
+    (Minute1d, TRADING_MINUTES_PER_DAY, datetime.timedelta(hours=15, minutes=59)),
+    (Minute1h, 60, datetime.timedelta(minutes=59)),
+    (Minute15m, 15, datetime.timedelta(minutes=14)),
+    (Minute5m, 5, datetime.timedelta(minutes=4)),
+)
 
 ROLLING_CORRELATION_WINDOW = 15
-ROLLING_CORRELATION_INTERVAL = datetime.timedelta(minutes=ROLLING_CORRELATION_WINDOW)
+ROLLING_CORRELATION_WINDOWS = (5, 15, 30, 60)
+ROLLING_CORRELATION_INTERVAL = datetime.timedelta(minutes=max(ROLLING_CORRELATION_WINDOWS))
 
 
 class InvalidSymbol(Exception):
@@ -190,20 +213,144 @@ def data_day(symbol, day):
     return Minute.timescale.filter(symbol__symbol=symbol, time__range=day_to_range(day))
 
 
-def rolling_correlation_data_day(symbol, day, data_type):
-    return RollingCorrelation.timescale.filter(symbol__symbol=symbol, time__range=day_to_range(day), window=ROLLING_CORRELATION_WINDOW, data_type=data_type)
+def days_query(days):
+    query = Q()
+    for day in days:
+        query |= Q(time__range=day_to_range(day))
+    return query
 
 
-def data_all(symbol):
-    return Minute.timescale.filter(symbol__symbol=symbol)
+def day_columns(symbols, days, fields):
+    # Minute data per (symbol, day) as (epoch seconds, values) arrays. COMPLETE
+    # days come from the day cache; the rest are loaded in one ordered query
+    # and cached if their day is COMPLETE.
+    columns = {}
+    missing = defaultdict(list)
 
+    for symbol in symbols:
+        for day in days:
+            cached = day_cache.get(symbol, day, fields)
+            if cached is None:
+                missing[day].append(symbol)
+            else:
+                columns[symbol, day] = cached
+
+    if not missing:
+        return columns
+
+    # Read which days are COMPLETE before their minutes, so a day that
+    # completes in between isn't cached with partial data
+    complete = set(DataDay.objects
+                   .filter(symbol__symbol__in={symbol for day_symbols in missing.values() for symbol in day_symbols},
+                           day__in=missing.keys(), state=DataDay.State.COMPLETE)
+                   .values_list("symbol__symbol", "day"))
 
-def data_multiple(symbol, days):
     query = Q()
-    for day in days:
-        query |= Q(time__range=day_to_range(day))
+    for day, day_symbols in missing.items():
+        query |= Q(time__range=day_to_range(day), symbol__symbol__in=day_symbols)
+
+    columns.update(query_day_columns(Minute.timescale, query, fields))
+
+    empty = (numpy.array([], dtype=numpy.int64), numpy.empty((0, len(fields))))
+    for symbol, day in complete:
+        if symbol in missing[day]:
+            day_cache.put(symbol, day, fields, *columns.get((symbol, day), empty))
+    day_cache.evict_if_full()
+
+    return columns
+
+
+def query_day_columns(manager, query, fields, offset=datetime.timedelta()):
+    # Rows of Minute or a rollup grouped into (epoch seconds, values) arrays
+    # per (symbol, day), with offset added to each time
+    rows = (manager.filter(query)
+            .order_by("symbol__symbol", "time")
+            .values_list("symbol__symbol", "time", *fields))
+
+    columns = {}
+    offset = int(offset.total_seconds())
+    key = lambda row: (row[0], timezone.localdate(row[1]))
+    for (symbol, day), day_rows in itertools.groupby(rows, key=key):
+        day_rows = list(day_rows)
+        times = numpy.array([row[1].timestamp() for row in day_rows], dtype=numpy.int64) + offset
+        values = numpy.array([row[2:] for row in day_rows], dtype=numpy.float64).reshape(len(day_rows), len(fields))
+        columns[symbol, day] = (times, values)
+
+    return columns
+
+
+def chart_resolution(days, points):
+    # Trading minutes each plotted point stands for
+    return len(days) * TRADING_MINUTES_PER_DAY / points
+
+
+def rollup_for(resolution):
+    # The coarsest rollup with buckets no wider than resolution, if any
+    for rollup in ROLLUPS:
+        if rollup[1] <= resolution:
+            return rollup
+    return None
+
+
+def rollup_columns(rollup, symbols, days, fields):
+    model, _, offset = rollup
+    query = days_query(days) & Q(symbol__symbol__in=symbols)
+    return query_day_columns(model.objects, query, fields, offset)
+
+
+def chart_columns(symbols, days, fields, resolution=1):
+    # All symbols and days returned per symbol as an array of epoch seconds
+    # and a float array per field. A gap (NaN) is added after each past day so chart
+    # lines break between days. Ranges too long to plot every minute are read
+    # from the coarsest rollup that still gives the requested resolution.
+    rollup = rollup_for(resolution)
+    if rollup is None:
+        by_day = day_columns(symbols, days, fields)
+    else:
+        by_day = rollup_columns(rollup, symbols, days, fields)
+
+    today = timezone.localdate()
+    gap = numpy.full((1, len(fields)), numpy.nan)
+    columns = {}
+
+    for symbol in symbols:
+        times = [numpy.array([], dtype=numpy.int64)]
+        values = [numpy.empty((0, len(fields)))]
+
+        for day in sorted(days):
+            day_times, day_values = by_day.get((symbol, day), (times[0], values[0]))
+            if not len(day_times):
+                continue
+
+            times.append(day_times)
+            values.append(day_values)
+            if day != today:
+                times.append(day_times[-1:] + int(market.ONE_MINUTE.total_seconds()))
+                values.append(gap)
+
+        values = numpy.concatenate(values)
+        columns[symbol] = {"time": numpy.concatenate(times)}
+        for i, field in enumerate(fields):
+            columns[symbol][field] = values[:, i]
+
+    return columns
+
+
+def rolling_correlation_columns(symbol, days, window, times):
+    # Rolling correlations for each data type aligned to the given epoch seconds
+    rows = (RollingCorrelation.timescale.filter(days_query(days), symbol__symbol=symbol, window=window)
+            .values_list("data_type", "time", "value"))
 
-    return Minute.timescale.filter(query, symbol__symbol=symbol)
+    by_type = defaultdict(dict)
+    for data_type, time, value in rows:
+        by_type[data_type][int(time.timestamp())] = value
+
+    return {data_type: numpy.array([by_type[data_type].get(time) for time in times.tolist()], dtype=numpy.float64)
+            for data_type in RollingCorrelation.DataType}
+
+
+def json_column(values):
+    return [None if math.isnan(value) else value for value in values.tolist()]
 
 
 def name_for_symbol(symbol):
@@ -215,14 +362,6 @@ def minute_before(symbol, minute):
     return Minute.timescale.get(symbol__symbol=symbol, time=(minute - datetime.timedelta(minutes=1)))
 
 
-def incoming_price_for(symbol, minute):
-    qs = IncomingPrice.objects.filter(symbol=symbol, time=(minute - datetime.timedelta(minutes=1)))
-    if not qs:
-        return None
-    else:
-        return qs[0]
-
-
 def clear_incoming_prices():
     IncomingPrice.objects.all().delete()
 
@@ -244,24 +383,66 @@ class Echo:
     def write(self, value):
         return value
 
-def stream_data_csv(qs):
-    # Adapted from Django docs
+def csv_value(value, places=0):
+    return None if math.isnan(value) else f"{value:.{places}f}"
+
+
+def stream_days_csv(symbol, days):
+    # Adapted from Django docs, with rows read through the day cache
     pseudo_buffer = Echo()
     writer = csv.writer(pseudo_buffer)
+    name = name_for_symbol(symbol)
+    days = sorted(days)
 
     yield writer.writerow(DATA_HEADER)
-    for row in qs:
+    for i in range(0, len(days), CSV_DAYS_PER_QUERY):
+        batch = days[i:i + CSV_DAYS_PER_QUERY]
+        columns = day_columns([symbol], batch, CSV_FIELDS)
+        for day in batch:
+            if (symbol, day) not in columns:
+                continue
+            times, values = columns[symbol, day]
+            for time, (last, volume, cumulative_volume, slope) in zip(times.tolist(), values.tolist()):
+                time = datetime.datetime.fromtimestamp(time, datetime.timezone.utc)
+                yield writer.writerow((
+                    name,
+                    time.strftime("%F"),
+                    time.strftime("%T"),
+                    csv_value(last, 4),
+                    csv_value(volume),
+                    csv_value(cumulative_volume),
+                    csv_value(slope),
+                ))
+
+
+def stream_summary_csv(symbol):
+    pseudo_buffer = Echo()
+    writer = csv.writer(pseudo_buffer)
+
+    yield writer.writerow(SUMMARY_HEADER)
+    for summary in DaySummary.objects.filter(symbol__symbol=symbol).select_related("symbol"):
         yield writer.writerow((
-            row.symbol.display_name,
-            row.time.strftime("%F"),
-            row.time.strftime("%T"),
-            row.last,
-            row.volume,
-            row.cumulative_volume,
-            row.slope,
+            summary.symbol.display_name,
+            summary.day.strftime("%F"),
+            summary.open,
+            summary.close,
+            summary.low,
+            summary.high,
+            summary.cumulative_volume,
+            summary.slope_change,
+            summary.volume_correlation,
+            summary.slope_correlation,
+            summary.minutes,
         ))
 
 
+def data_days(symbol):
+    # Every day with Minute rows, whatever the state of its DataDay
+    return list(Minute.timescale.filter(symbol__symbol=symbol)
+                .annotate(day=TruncDate("time"))
+                .order_by("day").values_list("day", flat=True).distinct())
+
+
 def correlation_dict(today_data, previous_data):
     data = OrderedDict()
     for d in today_data:
@@ -281,19 +462,117 @@ def correlation_days(today, previous_day, data_type, symbols):
     return correlation_dict(today_data, previous_data)
 
 
-def correlation_objects(symbol, day, day_data):
-    vc = Correlation(
-        symbol=symbol,
-        day=day,
-        data_type=Correlation.DataType.VOLUME,
-        value=calculate.volume_correlation(day_data))
-    sc = Correlation(
-        symbol=symbol,
-        day=day,
-        data_type=Correlation.DataType.SLOPE,
-        value=calculate.slope_correlation(day_data))
+def day_conditions(symbols, start, end):
+    # WHERE clause and parameters for set-based queries over the days from
+    # start to end, either of which may be None for no limit
+    conditions = ["TRUE"]
+    params = {
+        "tz": timezone.get_current_timezone_name(),
+        "complete": DataDay.State.COMPLETE,
+    }
 
-    return vc, sc
+    if symbols is not None:
+        conditions.append("symbol_id = ANY(%(symbol_ids)s)")
+        params["symbol_ids"] = [symbol.id for symbol in symbols]
+    if start is not None:
+        conditions.append("time >= %(start)s")
+        params["start"] = day_to_range(start)[0]
+    if end is not None:
+        conditions.append("time < %(end)s")
+        params["end"] = day_to_range(end)[1]
+
+    return " AND ".join(conditions), params
+
+
+def update_correlations(symbols=None, start=None, end=None):
+    # Recompute daily price correlations for complete days from start to end
+    # in one GROUP BY query with corr(), upserted into Correlation
+    conditions, params = day_conditions(symbols, start, end)
+    params["volume"] = Correlation.DataType.VOLUME
+    params["slope"] = Correlation.DataType.SLOPE
+
+    sql = f"""
+        INSERT INTO volume_correlation (symbol_id, day, data_type, value, x_mean, y_mean, "N", "D", "E", n)
+        SELECT c.symbol_id, c.day, t.data_type, t.value, 0, 0, 0, 0, 0, 0
+        FROM (
+            SELECT symbol_id,
+                   (time AT TIME ZONE %(tz)s)::date AS day,
+                   corr("last"::float8, cumulative_volume::float8) AS volume,
+                   corr("last"::float8, slope::float8) AS slope
+            FROM volume_minute
+            WHERE {conditions}
+            GROUP BY 1, 2
+        ) c
+        JOIN volume_dataday d ON d.symbol_id = c.symbol_id AND d.day = c.day AND d.state = %(complete)s
+        CROSS JOIN LATERAL (VALUES (%(volume)s, c.volume), (%(slope)s, c.slope)) AS t(data_type, value)
+        WHERE t.value IS NOT NULL
+        ON CONFLICT (symbol_id, day, data_type) DO UPDATE SET value = EXCLUDED.value
+    """
+
+    with django.db.connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def update_day_summaries(symbols=None, start=None, end=None):
+    # Recompute DaySummary for complete days from start to end in one query
+    conditions, params = day_conditions(symbols, start, end)
+    params["window"] = ROLLING_CORRELATION_WINDOW
+    params["volume"] = RollingCorrelation.DataType.VOLUME
+    params["slope"] = RollingCorrelation.DataType.SLOPE
+
+    sql = f"""
+        INSERT INTO volume_daysummary (data_day_id, symbol_id, day, open, close, low, high, cumulative_volume,
+                                       open_slope, close_slope, volume_correlation, slope_correlation,
+                                       rolling_volume_correlation, rolling_slope_correlation, minutes)
+        SELECT d.id, d.symbol_id, d.day, m.open, m.close, m.low, m.high, m.cumulative_volume,
+               m.open_slope, m.close_slope, m.volume_correlation, m.slope_correlation,
+               r.volume_correlation, r.slope_correlation, m.minutes
+        FROM (
+            SELECT symbol_id,
+                   (time AT TIME ZONE %(tz)s)::date AS day,
+                   first("last", time) AS open,
+                   last("last", time) AS close,
+                   min("last") AS low,
+                   max("last") AS high,
+                   last(cumulative_volume, time) AS cumulative_volume,
+                   first(slope, time) AS open_slope,
+                   last(slope, time) AS close_slope,
+                   corr("last"::float8, cumulative_volume::float8) AS volume_correlation,
+                   corr("last"::float8, slope::float8) AS slope_correlation,
+                   count(*) AS minutes
+            FROM volume_minute
+            WHERE {conditions}
+            GROUP BY 1, 2
+        ) m
+        JOIN volume_dataday d ON d.symbol_id = m.symbol_id AND d.day = m.day AND d.state = %(complete)s
+        LEFT JOIN (
+            SELECT symbol_id,
+                   (time AT TIME ZONE %(tz)s)::date AS day,
+                   last(value, time) FILTER (WHERE data_type = %(volume)s) AS volume_correlation,
+                   last(value, time) FILTER (WHERE data_type = %(slope)s) AS slope_correlation
+            FROM volume_rollingcorrelation
+            WHERE {conditions} AND "window" = %(window)s
+            GROUP BY 1, 2
+        ) r ON r.symbol_id = m.symbol_id AND r.day = m.day
+        ON CONFLICT (data_day_id) DO UPDATE SET
+            open = EXCLUDED.open,
+            close = EXCLUDED.close,
+            low = EXCLUDED.low,
+            high = EXCLUDED.high,
+            cumulative_volume = EXCLUDED.cumulative_volume,
+            open_slope = EXCLUDED.open_slope,
+            close_slope = EXCLUDED.close_slope,
+            volume_correlation = EXCLUDED.volume_correlation,
+            slope_correlation = EXCLUDED.slope_correlation,
+            rolling_volume_correlation = EXCLUDED.rolling_volume_correlation,
+            rolling_slope_correlation = EXCLUDED.rolling_slope_correlation,
+            minutes = EXCLUDED.minutes
+    """
+
+    with django.db.connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
 
 
 def slope_table_minutes(current_minute):
@@ -343,69 +622,128 @@ def slope_table_data(symbols, current_minute):
             slope_table_dict(current_data, previous_minute_data, previous_close_data))
 
 
+def minute_close_prices(symbol_ids, day):
+    _, last_minute = market.first_last_minute(day)
+    return dict(Minute.timescale.filter(symbol_id__in=symbol_ids, time=last_minute)
+                .values_list("symbol_id", "last"))
+
+
 def comparison_table_data(symbols, start, end, use_previous_close):
-    minutes = Minute.timescale.filter(symbol__in=symbols, symbol__active=True, time__gte=start, time__lte=end).select_related("symbol")
-    volume_rolling = RollingCorrelation.timescale.filter(symbol__in=symbols, symbol__active=True, time__gte=start, time__lte=end, data_type=RollingCorrelation.DataType.VOLUME, window=ROLLING_CORRELATION_WINDOW).select_related("symbol")
-    slope_rolling = RollingCorrelation.timescale.filter(symbol__in=symbols, symbol__active=True, time__gte=start, time__lte=end, data_type=RollingCorrelation.DataType.SLOPE, window=ROLLING_CORRELATION_WINDOW).select_related("symbol")
+    # One row per symbol from first/last values and correlations aggregated
+    # in the database, plus the last rolling correlation of each type
+    symbol_objs = {symbol.id: symbol for symbol in symbols if symbol.active}
+    symbol_ids = list(symbol_objs)
+
+    with django.db.connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT symbol_id,
+                   first("last", time), last("last", time),
+                   first(slope, time), last(slope, time),
+                   corr("last"::float8, cumulative_volume::float8),
+                   corr("last"::float8, slope::float8)
+            FROM volume_minute
+            WHERE symbol_id = ANY(%s) AND time >= %s AND time <= %s
+            GROUP BY symbol_id
+        """, [symbol_ids, start, end])
+        minute_rows = cursor.fetchall()
+
+        cursor.execute("""
+            SELECT symbol_id, data_type, last(value, time)
+            FROM volume_rollingcorrelation
+            WHERE symbol_id = ANY(%s) AND "window" = %s AND time >= %s AND time <= %s
+            GROUP BY symbol_id, data_type
+        """, [symbol_ids, ROLLING_CORRELATION_WINDOW, start, end])
+        rolling_rows = cursor.fetchall()
 
     if use_previous_close:
         previous_day = market.previous_trading_day(start.date())
-        _, prev_last_minute = market.first_last_minute(previous_day)
-        prev_close = Minute.timescale.filter(symbol__in=symbols, symbol__active=True, time=prev_last_minute).select_related("symbol")
-        prev_close_prices = {m.symbol.symbol: m.last for m in prev_close}
+        prev_close_prices = minute_close_prices(symbol_ids, previous_day)
 
-    by_symbol = defaultdict(list)
-    volume_rolling_by_symbol = defaultdict(list)
-    slope_rolling_by_symbol = defaultdict(list)
-    data = defaultdict(dict)
+    rolling_keys = {
+        RollingCorrelation.DataType.VOLUME: "rolling_volume_correlation",
+        RollingCorrelation.DataType.SLOPE: "rolling_slope_correlation",
+    }
+    rolling = defaultdict(dict)
+    for symbol_id, data_type, value in rolling_rows:
+        rolling[symbol_id][rolling_keys[data_type]] = value
+
+    data = []
+    for symbol_id, first_last, last_last, first_slope, last_slope, volume_corr, slope_corr in minute_rows:
+        symbol = symbol_objs[symbol_id]
+        row = {
+            "symbol": symbol.symbol,
+            "name": symbol.display_name,
+            **rolling[symbol_id],
+        }
+
+        if first_slope is not None and last_slope is not None:
+            row["slope_diff"] = last_slope - first_slope
 
-    for minute in minutes:
-        by_symbol[minute.symbol.symbol].append(minute)
+        # Calculate price difference
+        if use_previous_close:
+            start_price = prev_close_prices.get(symbol_id)
+        else:
+            start_price = first_last
 
-    for roll in volume_rolling:
-        volume_rolling_by_symbol[roll.symbol.symbol].append(roll)
+        if start_price is not None and last_last is not None:
+            row["price_diff"] = 100*(last_last - start_price) / start_price
+        else:
+            logging.warning(f"No start or last price for {symbol.symbol}")
 
-    for symbol, symbol_data in volume_rolling_by_symbol.items():
-        if symbol_data:
-            last = symbol_data[-1]
-            data[symbol]["rolling_volume_correlation"] = last.value
+        if volume_corr is not None:
+            row["volume_correlation"] = volume_corr
+        if slope_corr is not None:
+            row["slope_correlation"] = slope_corr
 
-    for roll in slope_rolling:
-        slope_rolling_by_symbol[roll.symbol.symbol].append(roll)
+        data.append(row)
 
-    for symbol, symbol_data in slope_rolling_by_symbol.items():
-        if symbol_data:
-            last = symbol_data[-1]
-            data[symbol]["rolling_slope_correlation"] = last.value
+    return data
 
-    for symbol, symbol_data in by_symbol.items():
-        first, last = symbol_data[0], symbol_data[-1]
-        data[symbol]["symbol"] = symbol
-        data[symbol]["name"] = first.symbol.display_name
-        data[symbol]["slope_diff"] = last.slope - first.slope
 
-        # Calculate price difference
+def comparison_table_summary(symbols, day, use_previous_close):
+    # Whole day comparison rows read from DaySummary, falling back to the
+    # minute aggregation for symbols whose day has not been summarised
+    symbols = [symbol for symbol in symbols if symbol.active]
+    summaries = DaySummary.objects.filter(symbol__in=symbols, day=day).select_related("symbol")
+
+    if use_previous_close:
+        previous_day = market.previous_trading_day(day)
+        prev_close_prices = dict(DaySummary.objects.filter(symbol__in=symbols, day=previous_day)
+                                 .values_list("symbol_id", "close"))
+        # Days from before summaries existed close on their last minute
+        unsummarised = [symbol.id for symbol in symbols if symbol.id not in prev_close_prices]
+        if unsummarised:
+            prev_close_prices.update(minute_close_prices(unsummarised, previous_day))
+
+    data = []
+    for summary in summaries:
+        row = {
+            "symbol": summary.symbol.symbol,
+            "name": summary.symbol.display_name,
+            "rolling_volume_correlation": summary.rolling_volume_correlation,
+            "rolling_slope_correlation": summary.rolling_slope_correlation,
+            "volume_correlation": summary.volume_correlation,
+            "slope_correlation": summary.slope_correlation,
+            "slope_diff": summary.slope_change,
+        }
+
         if use_previous_close:
-            start_price = prev_close_prices.get(symbol)
+            start_price = prev_close_prices.get(summary.symbol_id)
         else:
-            start_price = first.last
+            start_price = summary.open
 
-        if start_price is not None and last.last is not None:
-            data[symbol]["price_diff"] = 100*(last.last - start_price) / start_price
-        else:
-            print(f"No last for {first} or {last} for {symbol}")
+        if start_price and summary.close is not None:
+            row["price_diff"] = 100*(summary.close - start_price) / start_price
+
+        data.append({key: value for key, value in row.items() if value is not None})
 
-        try:
-            data[symbol]["volume_correlation"] = calculate.volume_correlation(symbol_data)
-        except TypeError:
-            print(f"Error calculating volume correlation for {symbol}")
-        try:
-            data[symbol]["slope_correlation"] = calculate.slope_correlation(symbol_data)
-        except TypeError:
-            print(f"Error calculating slope correlation for {symbol}")
+    summarised = {summary.symbol_id for summary in summaries}
+    missing = [symbol for symbol in symbols if symbol.id not in summarised]
+    if missing:
+        start, end = market.first_last_minute(day)
+        data += comparison_table_data(missing, start, end, use_previous_close)
 
-    # return sorted(data.values(), key=operator.itemgetter("price_diff"))
-    return list(data.values())
+    return data
 
 
 def missing_minutes(symbol, day):
@@ -419,55 +757,67 @@ def missing_minutes(symbol, day):
     return sorted(missing)
 
 
-def missing_rolling_correlation_minutes(symbol, day, data_type):
-    existing_data = rolling_correlation_data_day(symbol.symbol, day, data_type)
-    existing_minutes = set(existing_data.values_list("time", flat=True))
+def all_missing_rolling_correlation_minutes(symbol, day):
+    existing_data = RollingCorrelation.timescale.filter(symbol=symbol,
+                                                        time__range=day_to_range(day),
+                                                        window__in=ROLLING_CORRELATION_WINDOWS)
+    existing_minutes = defaultdict(set)
+    for data_type, window, time in existing_data.values_list("data_type", "window", "time"):
+        existing_minutes[data_type, window].add(time)
 
     market_open, market_close = market.open_close(day)
-    start = market_open + datetime.timedelta(minutes=ROLLING_CORRELATION_WINDOW) - market.ONE_MINUTE
-    trading_minutes = set(minute for minute in market.trading_minutes(day)
-                          if minute >= start)
+    trading_minutes = list(market.trading_minutes(day))
 
-    missing = trading_minutes - existing_minutes
+    missing = {}
+    for data_type in RollingCorrelation.DataType:
+        for window in ROLLING_CORRELATION_WINDOWS:
+            start = market_open + datetime.timedelta(minutes=window) - market.ONE_MINUTE
+            missing[data_type, window] = sorted(minute for minute in trading_minutes
+                                                if minute >= start and minute not in existing_minutes[data_type, window])
 
-    return sorted(missing)
+    return missing
 
 
-def rolling_correlations_for_day(symbol_obj, day, data=None):
+def rolling_correlation_objects(symbol_obj, data, missing):
+    # One set of prefix sums per data type serves every window
     rolls = []
 
-    missing_volume = missing_rolling_correlation_minutes(symbol_obj, day, RollingCorrelation.DataType.VOLUME)
-    missing_slope = missing_rolling_correlation_minutes(symbol_obj, day, RollingCorrelation.DataType.SLOPE)
-
-    if not (missing_volume or missing_slope):
-        return []
+    for data_type in RollingCorrelation.DataType:
+        sums = calculate.RollingCorrelationSums(data, data_type)
 
-    if data is None:
-        data = data_day(symbol_obj.symbol, day)
+        for window in ROLLING_CORRELATION_WINDOWS:
+            missing_minutes = set(missing[data_type, window])
+            if not missing_minutes:
+                continue
 
-    for missing, data_type in ((missing_volume, RollingCorrelation.DataType.VOLUME), (missing_slope, RollingCorrelation.DataType.SLOPE)):
-
-        for minute in missing:
-            try:
-                corr = calculate.rolling_correlation(minute, data, data_type, ROLLING_CORRELATION_WINDOW)
-                if corr is None:
+            for minute, corr in sums.series(window):
+                if minute not in missing_minutes:
                     continue
 
                 roll = RollingCorrelation(
                     time=minute,
                     symbol=symbol_obj,
                     data_type=data_type,
-                    window=ROLLING_CORRELATION_WINDOW,
+                    window=window,
                     value=corr)
 
                 rolls.append(roll)
 
-            except (ValueError, TypeError) as e:
-                pass
-
     return rolls
 
 
+def rolling_correlations_for_day(symbol_obj, day, data=None):
+    missing = all_missing_rolling_correlation_minutes(symbol_obj, day)
+
+    if not any(missing.values()):
+        return []
+
+    if data is None:
+        data = data_day(symbol_obj.symbol, day)
+
+    return rolling_correlation_objects(symbol_obj, data, missing)
+
+
 def market_holidays():
     api_data = api.market_holidays()
     for rec in api_data:
@@ -527,3 +877,14 @@ def live_updates_pause():
     ss = SystemSetting.objects.get(name="live_paused")
     ss.set_value(True)
     ss.save()
+
+
+def record_live_tick(seconds):
+    SystemSetting.objects.update_or_create(
+        name="live_tick_seconds",
+        defaults={"data_type": SystemSetting.Type.FLOAT, "float_value": seconds})
+
+
+def live_tick_seconds():
+    ss = SystemSetting.objects.filter(name="live_tick_seconds").first()
+    return ss.value if ss is not None else None
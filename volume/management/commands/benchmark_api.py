@@ -0,0 +1,58 @@
+import datetime
+import statistics
+import time
+
+import requests
+from django.core.management.base import BaseCommand
+
+import volume.api as api
+import volume.market as market
+
+SYMBOL = "AAPL"
+
+
+def time_requests(get, minutes, symbol):
+    times = []
+    for minute in minutes:
+        params = {
+            "timestamp.lt": api.to_nanos(minute),
+            "sort": "timestamp",
+            "order": "desc",
+            "limit": 1,
+            "apiKey": api.API_KEY,
+        }
+        start = time.perf_counter()
+        r = get(api.BASE_URL + "/vX/quotes/" + symbol, params=params, timeout=api.TIMEOUT)
+        r.raise_for_status()
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+class Command(BaseCommand):
+    help = "Compare per-request time of bare requests against the pooled API session"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--symbol", default=SYMBOL)
+        parser.add_argument("--count", type=int, default=20)
+
+    def handle(self, *args, **kwargs):
+        symbol = kwargs["symbol"]
+        count = kwargs["count"]
+
+        day = market.previous_trading_day(datetime.date.today())
+        minutes = list(market.all_trading_minutes(day))[:count]
+
+        bare = time_requests(requests.get, minutes, symbol)
+
+        session = api.make_session(pool_size=1)
+        # Open the connection first so only reused requests are timed
+        time_requests(session.get, minutes[:1], symbol)
+        pooled = time_requests(session.get, minutes, symbol)
+        session.close()
+
+        for name, times in (("Bare", bare), ("Pooled", pooled)):
+            print(f"{name}:\tmean {1000*statistics.mean(times):.1f}ms\tmedian {1000*statistics.median(times):.1f}ms")
+
+        saved = statistics.mean(bare) - statistics.mean(pooled)
+        print(f"Saved per request: {1000*saved:.1f}ms")
@@ -3,14 +3,17 @@ import datetime
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
+import volume.day_cache
 import volume.utils
+from volume.models import ConstituentDay
 
 
 @transaction.atomic
-def delete_data(minutes, data_days, correlations):
+def delete_data(minutes, data_days, correlations, constituent_days):
     minutes.delete()
     data_days.delete()
     correlations.delete()
+    constituent_days.delete()
 
 
 class Command(BaseCommand):
@@ -25,11 +28,13 @@ class Command(BaseCommand):
         symbol = kwargs["symbol"]
 
         minutes, data_days, correlations = volume.utils.load_all_day_data(symbol, day)
+        constituent_days = ConstituentDay.objects.filter(symbol=symbol, day=day)
 
         print(f"For {symbol}")
         print(f"Found {minutes.count()} Minutes")
         print(f"Found {data_days.count()} DataDays")
         print(f"Found {correlations.count()} Correlations")
+        print(f"Found {constituent_days.count()} ConstituentDays")
 
         print("Type DELETE to confirm deletion")
         inp = input("> ")
@@ -38,5 +43,6 @@ class Command(BaseCommand):
             print("Aborting")
         else:
             print("Deleting")
-            delete_data(minutes, data_days, correlations)
+            delete_data(minutes, data_days, correlations, constituent_days)
+            volume.day_cache.invalidate(symbol, day.date())
             print("Done")
@@ -0,0 +1,122 @@
+import datetime
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+import volume.logic as logic
+from volume.models import DataDay, RollingCorrelation
+
+HYPERTABLES = ["volume_minute", "volume_rollingcorrelation"]
+ROLLING_CORRELATION_TABLE = "volume_rollingcorrelation"
+SCAN_REPEATS = 5
+# As set by the migration that enabled compression
+DEFAULT_COMPRESS_AFTER = datetime.timedelta(days=7)
+
+
+def execute(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        if cursor.description is not None:
+            return cursor.fetchall()
+
+
+def interval(days):
+    return datetime.timedelta(days=days)
+
+
+def table_sizes():
+    sizes = {}
+    for table in HYPERTABLES:
+        (total,), = execute("SELECT hypertable_size(%s)", [table])
+        (chunks, compressed), = execute(
+            "SELECT total_chunks, number_compressed_chunks FROM hypertable_compression_stats(%s)", [table])
+        sizes[table] = (total or 0, chunks or 0, compressed or 0)
+    return sizes
+
+
+def policy_compress_after(table):
+    # The compress_after of the table's current compression policy, if any
+    rows = execute("SELECT (config->>'compress_after')::interval FROM timescaledb_information.jobs "
+                   "WHERE proc_name = 'policy_compression' AND hypertable_name = %s", [table])
+    return rows[0][0] if rows else None
+
+
+def sample_day(older_than):
+    # The most recent complete day old enough to be compressed
+    return (DataDay.objects.filter(state=DataDay.State.COMPLETE, day__lt=datetime.date.today() - older_than)
+            .select_related("symbol").order_by("-day").first())
+
+
+def scan_time(day):
+    times = []
+    for _ in range(SCAN_REPEATS):
+        start = time.perf_counter()
+        rows = len(list(logic.data_day(day.symbol.symbol, day.day)))
+        times.append(time.perf_counter() - start)
+    return rows, statistics.median(times)
+
+
+def report(name, sizes, scan):
+    print(name)
+    for table, (total, chunks, compressed) in sizes.items():
+        print(f"  {table}:\t{total / 1024**2:.1f}MB\t{compressed}/{chunks} chunks compressed")
+    if scan is not None:
+        rows, seconds = scan
+        print(f"  data_day:\t{rows} rows in {1000*seconds:.1f}ms")
+
+
+class Command(BaseCommand):
+    help = "Manage compression and retention of the Minute and RollingCorrelation hypertables"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--compress-after", type=int,
+                            help="Set the compression policy to compress chunks older than this many days")
+        parser.add_argument("--compress-now", action="store_true",
+                            help="Compress eligible chunks now rather than waiting for the policy")
+        parser.add_argument("--rolling-retention", type=int,
+                            help="Drop rolling correlations older than this many days (0 removes the policy)")
+        parser.add_argument("--prune-windows", type=int,
+                            help=f"Delete rolling correlations older than this many days except the {logic.ROLLING_CORRELATION_WINDOW}m window")
+
+    def handle(self, *args, **kwargs):
+        # Only change the policies when asked, otherwise keep what is set
+        if kwargs["compress_after"] is not None:
+            compress_after = {table: interval(kwargs["compress_after"]) for table in HYPERTABLES}
+        else:
+            compress_after = {table: policy_compress_after(table) for table in HYPERTABLES}
+
+        day = sample_day(compress_after["volume_minute"] or DEFAULT_COMPRESS_AFTER)
+        report("Before", table_sizes(), day and scan_time(day))
+
+        if kwargs["compress_after"] is not None:
+            for table in HYPERTABLES:
+                execute("SELECT remove_compression_policy(%s, if_exists => true)", [table])
+                execute("SELECT add_compression_policy(%s, %s)", [table, compress_after[table]])
+
+        rolling_retention = kwargs["rolling_retention"]
+        if rolling_retention is not None:
+            execute("SELECT remove_retention_policy(%s, if_exists => true)", [ROLLING_CORRELATION_TABLE])
+            if rolling_retention > 0:
+                execute("SELECT add_retention_policy(%s, %s)", [ROLLING_CORRELATION_TABLE, interval(rolling_retention)])
+
+        prune_windows = kwargs["prune_windows"]
+        if prune_windows is not None:
+            before = datetime.date.today() - interval(prune_windows)
+            deleted, _ = (RollingCorrelation.objects
+                          .filter(time__lt=logic.day_to_range(before)[0])
+                          .exclude(window=logic.ROLLING_CORRELATION_WINDOW)
+                          .delete())
+            print(f"Deleted {deleted} rolling correlations")
+
+        if kwargs["compress_now"]:
+            for table in HYPERTABLES:
+                if compress_after[table] is None:
+                    print(f"No compression policy on {table}, pass --compress-after")
+                    continue
+                chunks = execute("SELECT compress_chunk(chunk, if_not_compressed => true) "
+                                 "FROM show_chunks(%s, older_than => %s) chunk", [table, compress_after[table]])
+                print(f"Compressed {len(chunks)} chunks of {table}")
+
+        report("After", table_sizes(), day and scan_time(day))
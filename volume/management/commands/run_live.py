@@ -21,7 +21,19 @@ logging.basicConfig(stream=sys.stdout, level=logging.INFO, format=LOG_FORMAT,
 class Command(BaseCommand):
     help = "Runs live updates"
 
+    def add_arguments(self, parser):
+        parser.add_argument("--daemon", action="store_true",
+                            help="Stay resident and run once after every minute boundary")
+        parser.add_argument("--offset", type=float,
+                            default=volume.live.TICK_OFFSET.total_seconds(),
+                            help="Seconds after the minute boundary to start each tick")
+
     def handle(self, *args, **kwargs):
+        if kwargs["daemon"]:
+            offset = datetime.timedelta(seconds=kwargs["offset"])
+            volume.live.run_forever(offset=offset)
+            return
+
         # time.sleep(SLEEP_TIME.total_seconds())
         if not volume.logic.is_live_paused():
             volume.live.run()
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('volume', '0032_systemsetting_data_type_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataday',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+    ]
@@ -0,0 +1,117 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:28
+
+from django.db import migrations, models
+
+
+# Continuous aggregates over volume_minute as (view, bucket, refresh interval).
+# Days are bucketed in market time so each bucket holds one trading day.
+ROLLUPS = [
+    ("volume_minute_5m", "time_bucket(INTERVAL '5 minutes', time)", "5 minutes"),
+    ("volume_minute_15m", "time_bucket(INTERVAL '15 minutes', time)", "15 minutes"),
+    ("volume_minute_1h", "time_bucket(INTERVAL '1 hour', time)", "1 hour"),
+    ("volume_minute_1d", "time_bucket(INTERVAL '1 day', time, 'America/New_York')", "1 hour"),
+]
+
+
+def create_rollup(name, bucket, interval):
+    # start_offset is NULL so backfilled days are picked up from the
+    # invalidation log; real time aggregation covers the current bucket
+    return migrations.RunSQL(
+        f"""
+        CREATE MATERIALIZED VIEW {name}
+        WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+        SELECT symbol_id,
+               {bucket} AS "time",
+               last("last", time) AS "last",
+               sum(volume) AS volume,
+               last(cumulative_volume, time) AS cumulative_volume,
+               last(slope, time) AS slope
+        FROM volume_minute
+        GROUP BY symbol_id, {bucket}
+        WITH NO DATA;
+
+        CREATE INDEX {name}_symbol_time ON {name} (symbol_id, "time");
+
+        SELECT add_continuous_aggregate_policy('{name}',
+            start_offset => NULL,
+            end_offset => INTERVAL '{interval}',
+            schedule_interval => INTERVAL '{interval}');
+        """,
+        f"DROP MATERIALIZED VIEW IF EXISTS {name};",
+    )
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('volume', '0033_dataday_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Minute15m',
+            fields=[
+                ('time', models.DateTimeField(primary_key=True, serialize=False)),
+                ('last', models.DecimalField(decimal_places=4, max_digits=12, null=True)),
+                ('volume', models.BigIntegerField(null=True)),
+                ('cumulative_volume', models.IntegerField(null=True)),
+                ('slope', models.IntegerField(null=True)),
+            ],
+            options={
+                'db_table': 'volume_minute_15m',
+                'ordering': ['time'],
+                'abstract': False,
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Minute1d',
+            fields=[
+                ('time', models.DateTimeField(primary_key=True, serialize=False)),
+                ('last', models.DecimalField(decimal_places=4, max_digits=12, null=True)),
+                ('volume', models.BigIntegerField(null=True)),
+                ('cumulative_volume', models.IntegerField(null=True)),
+                ('slope', models.IntegerField(null=True)),
+            ],
+            options={
+                'db_table': 'volume_minute_1d',
+                'ordering': ['time'],
+                'abstract': False,
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Minute1h',
+            fields=[
+                ('time', models.DateTimeField(primary_key=True, serialize=False)),
+                ('last', models.DecimalField(decimal_places=4, max_digits=12, null=True)),
+                ('volume', models.BigIntegerField(null=True)),
+                ('cumulative_volume', models.IntegerField(null=True)),
+                ('slope', models.IntegerField(null=True)),
+            ],
+            options={
+                'db_table': 'volume_minute_1h',
+                'ordering': ['time'],
+                'abstract': False,
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Minute5m',
+            fields=[
+                ('time', models.DateTimeField(primary_key=True, serialize=False)),
+                ('last', models.DecimalField(decimal_places=4, max_digits=12, null=True)),
+                ('volume', models.BigIntegerField(null=True)),
+                ('cumulative_volume', models.IntegerField(null=True)),
+                ('slope', models.IntegerField(null=True)),
+            ],
+            options={
+                'db_table': 'volume_minute_5m',
+                'ordering': ['time'],
+                'abstract': False,
+                'managed': False,
+            },
+        ),
+    ] + [create_rollup(*rollup) for rollup in ROLLUPS]
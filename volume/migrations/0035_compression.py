@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+# Hypertable, segmentby and orderby for native compression. Queries always
+# filter on one symbol, so each symbol's rows are compressed together.
+COMPRESSED_TABLES = [
+    ("volume_minute", "symbol_id", "time"),
+    ("volume_rollingcorrelation", "symbol_id", 'data_type, "window", time'),
+]
+
+COMPRESS_AFTER = "7 days"
+
+
+def enable_compression(table, segmentby, orderby):
+    return migrations.RunSQL(
+        f"""
+        ALTER TABLE {table} SET (
+            timescaledb.compress,
+            timescaledb.compress_segmentby = '{segmentby}',
+            timescaledb.compress_orderby = '{orderby}'
+        );
+
+        SELECT add_compression_policy('{table}', INTERVAL '{COMPRESS_AFTER}');
+        """,
+        f"""
+        SELECT remove_compression_policy('{table}', if_exists => true);
+        SELECT decompress_chunk(chunk, true) FROM show_chunks('{table}') chunk;
+        ALTER TABLE {table} SET (timescaledb.compress = false);
+        """,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('volume', '0034_minute_rollups'),
+    ]
+
+    operations = [enable_compression(*table) for table in COMPRESSED_TABLES]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('volume', '0035_compression'),
+    ]
+
+    operations = [
+        # Keep only the newest of any duplicated correlations
+        migrations.RunSQL(
+            """
+            DELETE FROM volume_correlation a
+            USING volume_correlation b
+            WHERE a.symbol_id = b.symbol_id
+              AND a.day = b.day
+              AND a.data_type = b.data_type
+              AND a.id < b.id;
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='correlation',
+            constraint=models.UniqueConstraint(fields=('symbol', 'day', 'data_type'), name='unique_correlation'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('volume', '0036_correlation_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DaySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True)),
+                ('open', models.DecimalField(decimal_places=4, max_digits=12, null=True)),
+                ('close', models.DecimalField(decimal_places=4, max_digits=12, null=True)),
+                ('low', models.DecimalField(decimal_places=4, max_digits=12, null=True)),
+                ('high', models.DecimalField(decimal_places=4, max_digits=12, null=True)),
+                ('cumulative_volume', models.IntegerField(null=True)),
+                ('open_slope', models.IntegerField(null=True)),
+                ('close_slope', models.IntegerField(null=True)),
+                ('volume_correlation', models.FloatField(null=True)),
+                ('slope_correlation', models.FloatField(null=True)),
+                ('rolling_volume_correlation', models.FloatField(null=True)),
+                ('rolling_slope_correlation', models.FloatField(null=True)),
+                ('minutes', models.IntegerField(default=0)),
+                ('data_day', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='volume.dataday')),
+                ('symbol', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='volume.symbol')),
+            ],
+            options={
+                'ordering': ['day'],
+                'indexes': [models.Index(fields=['symbol', 'day'], name='volume_days_symbol__81e1ae_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('volume', '0037_daysummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataday',
+            name='lease_expires',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='dataday',
+            name='lease_owner',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='dataday',
+            name='state',
+            field=models.CharField(choices=[('C', 'Complete'), ('P', 'Pending'), ('L', 'Live'), ('R', 'Running')], db_index=True, default='P', max_length=1),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:38
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('volume', '0038_dataday_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConstituentDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=10)),
+                ('day', models.DateField(db_index=True)),
+                ('volume', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), size=None)),
+                ('last', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(null=True), size=None)),
+                ('last_mid_before', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(null=True), size=None)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='constituentday',
+            constraint=models.UniqueConstraint(fields=('symbol', 'day'), name='unique_constituent_day'),
+        ),
+    ]
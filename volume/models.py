@@ -1,6 +1,7 @@
 import dataclasses
 import datetime
 
+from django.contrib.postgres.fields import ArrayField
 from django.db import models
 from django.template.defaultfilters import slugify
 from django.urls import reverse
@@ -139,6 +140,48 @@ class IndexWeight(models.Model):
         return f"{self.index}: {self.symbol} = {self.weight}"
 
 
+class ConstituentDay(models.Model):
+    # A day of minutes worked out for an index constituent that wasn't
+    # otherwise backfilled, kept so other indices and a later Symbol for the
+    # same stock can use it. Values are per trading minute of the day.
+    symbol = models.CharField(max_length=10)
+    day = models.DateField(db_index=True)
+    volume = ArrayField(models.BigIntegerField())
+    last = ArrayField(models.FloatField(null=True))
+    last_mid_before = ArrayField(models.FloatField(null=True))
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.symbol}:{self.day:%F}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["symbol", "day"], name="unique_constituent_day"),
+        ]
+
+    @classmethod
+    def from_minute_data(cls, symbol, day, data):
+        return cls(
+            symbol=symbol,
+            day=day,
+            volume=[md.volume for md in data],
+            last=[md.last for md in data],
+            last_mid_before=[md.last_mid_before for md in data],
+        )
+
+    def to_minute_data(self, minutes):
+        results = []
+        cumulative_volume = 0
+        cumulative_slope = 0
+        for dt, volume, last, last_mid in zip(minutes, self.volume, self.last, self.last_mid_before, strict=True):
+            cumulative_volume += volume
+            # Sign of the volume, as calculate.calculate_slope
+            cumulative_slope += (volume > 0) - (volume < 0)
+            results.append(MinuteData(dt, self.symbol, last, volume, cumulative_volume, last_mid, cumulative_slope))
+
+        return results
+
+
 class Chart(models.Model):
     class DataType(models.TextChoices):
         VOLUME = "V", "Volume"
@@ -233,6 +276,9 @@ class Correlation(models.Model):
         indexes = [
             models.Index(fields=["symbol", "day", "data_type"]),
         ]
+        constraints = [
+            models.UniqueConstraint(fields=["symbol", "day", "data_type"], name="unique_correlation"),
+        ]
 
 
 class MarketHoliday(models.Model):
@@ -279,6 +325,7 @@ class DataDay(models.Model):
         COMPLETE = "C", "Complete"
         PENDING = "P", "Pending"
         LIVE = "L", "Live"
+        RUNNING = "R", "Running"
         # ABSENT = "A", "Absent"
 
     symbol = models.ForeignKey(Symbol, on_delete=models.CASCADE)
@@ -288,6 +335,10 @@ class DataDay(models.Model):
                              default=State.PENDING,
                              db_index=True)
     last_tried = models.DateTimeField(null=True, db_index=True, blank=True)
+    modified = models.DateTimeField(auto_now=True, null=True, blank=True)
+    # Set while a backfill worker holds the day; see backfill.claim_days
+    lease_owner = models.CharField(max_length=100, null=True, blank=True)
+    lease_expires = models.DateTimeField(null=True, db_index=True, blank=True)
 
     def __str__(self):
         return f"{self.symbol}:{self.day:%F}"
@@ -303,6 +354,47 @@ class DataDay(models.Model):
         ]
 
 
+class DaySummary(models.Model):
+    # Facts about a COMPLETE day, filled in once so overviews need not scan minutes
+    data_day = models.OneToOneField(DataDay, on_delete=models.CASCADE, related_name="summary")
+    symbol = models.ForeignKey(Symbol, on_delete=models.CASCADE)
+    day = models.DateField(db_index=True)
+
+    open = models.DecimalField(max_digits=12, decimal_places=4, null=True)
+    close = models.DecimalField(max_digits=12, decimal_places=4, null=True)
+    low = models.DecimalField(max_digits=12, decimal_places=4, null=True)
+    high = models.DecimalField(max_digits=12, decimal_places=4, null=True)
+    cumulative_volume = models.IntegerField(null=True)
+    open_slope = models.IntegerField(null=True)
+    close_slope = models.IntegerField(null=True)
+    volume_correlation = models.FloatField(null=True)
+    slope_correlation = models.FloatField(null=True)
+    rolling_volume_correlation = models.FloatField(null=True)
+    rolling_slope_correlation = models.FloatField(null=True)
+    minutes = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.symbol}:{self.day:%F}"
+
+    @property
+    def price_change(self):
+        if self.open is None or self.close is None or not self.open:
+            return None
+        return 100*(self.close - self.open) / self.open
+
+    @property
+    def slope_change(self):
+        if self.open_slope is None or self.close_slope is None:
+            return None
+        return self.close_slope - self.open_slope
+
+    class Meta:
+        ordering = ["day"]
+        indexes = [
+            models.Index(fields=["symbol", "day"]),
+        ]
+
+
 class IncomingPrice(models.Model):
     symbol = models.CharField(max_length=10, db_index=True)
     time = models.DateTimeField()
@@ -350,3 +442,55 @@ class Minute(TimescaleModel):
             last_mid_before=md.last_mid_before,
             slope=md.slope,
         )
+
+    def to_minute_data(self, symbol=None):
+        if symbol is None:
+            symbol = self.symbol.symbol
+
+        return MinuteData(
+            time=self.time,
+            symbol=symbol,
+            last=self.last,
+            volume=self.volume,
+            cumulative_volume=self.cumulative_volume,
+            last_mid_before=self.last_mid_before,
+            slope=self.slope,
+        )
+
+
+class MinuteRollup(models.Model):
+    # Continuous aggregates of Minute kept up to date by TimescaleDB
+    time = models.DateTimeField(primary_key=True)
+    symbol = models.ForeignKey(Symbol, on_delete=models.DO_NOTHING, related_name="+")
+    last = models.DecimalField(max_digits=12, decimal_places=4, null=True)
+    volume = models.BigIntegerField(null=True)
+    cumulative_volume = models.IntegerField(null=True)
+    slope = models.IntegerField(null=True)
+
+    def __str__(self):
+        return f"{self.symbol}:{self.time:%F %T}"
+
+    class Meta:
+        abstract = True
+        managed = False
+        ordering = ["time"]
+
+
+class Minute5m(MinuteRollup):
+    class Meta(MinuteRollup.Meta):
+        db_table = "volume_minute_5m"
+
+
+class Minute15m(MinuteRollup):
+    class Meta(MinuteRollup.Meta):
+        db_table = "volume_minute_15m"
+
+
+class Minute1h(MinuteRollup):
+    class Meta(MinuteRollup.Meta):
+        db_table = "volume_minute_1h"
+
+
+class Minute1d(MinuteRollup):
+    class Meta(MinuteRollup.Meta):
+        db_table = "volume_minute_1d"
@@ -0,0 +1,129 @@
+import logging
+import queue
+import threading
+import time
+
+
+# Items are (key, value) pairs. Each stage is called as func(key, value) and
+# its result becomes the value passed to the next stage. If a stage raises,
+# the item is dropped and on_error(key) is called; when the last stage
+# finishes an item on_done(key) is called.
+
+_STOP = object()
+
+
+class Stage:
+    def __init__(self, name, func, threads, queue_size):
+        self.name = name
+        self.func = func
+        self.threads = threads
+        self.input = queue.Queue(maxsize=queue_size)
+        self.workers = []
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.items = 0
+        self.errors = 0
+        # Seconds summed over this stage's threads
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+
+    def stats(self, interval):
+        with self.lock:
+            capacity = self.threads * interval
+            line = (f"{self.name}: {self.items} done, {self.errors} failed, "
+                    f"busy {self.busy / capacity:.0%}, starved {self.starved / capacity:.0%}, "
+                    f"blocked {self.blocked / capacity:.0%}, queued {self.input.qsize()}/{self.input.maxsize}")
+            self.reset_stats()
+        return line
+
+
+class Pipeline:
+    def __init__(self, stages, on_done=None, on_error=None):
+        self.stages = stages
+        self.on_done = on_done
+        self.on_error = on_error
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.stats_start = time.monotonic()
+
+    def start(self):
+        for i, stage in enumerate(self.stages):
+            following = self.stages[i + 1] if i + 1 < len(self.stages) else None
+            for n in range(stage.threads):
+                thread = threading.Thread(target=self.work, args=(stage, following),
+                                          name=f"{stage.name}-{n}", daemon=True)
+                thread.start()
+                stage.workers.append(thread)
+
+    def free(self):
+        # Room in the first stage's queue
+        first = self.stages[0].input
+        return max(first.maxsize - first.qsize(), 0)
+
+    def put(self, key):
+        with self.lock:
+            self.in_flight += 1
+        self.stages[0].input.put((key, None))
+
+    def finish(self, key, callback):
+        with self.lock:
+            self.in_flight -= 1
+        if callback is not None:
+            try:
+                callback(key)
+            except Exception:
+                logging.exception(f"Exception finishing {key}")
+
+    def work(self, stage, following):
+        while True:
+            wait_start = time.monotonic()
+            item = stage.input.get()
+            if item is _STOP:
+                return
+
+            key, value = item
+            start = time.monotonic()
+            failed = False
+            try:
+                value = stage.func(key, value)
+            except Exception:
+                logging.exception(f"Exception in {stage.name} for {key}")
+                failed = True
+            end = time.monotonic()
+
+            if failed:
+                self.finish(key, self.on_error)
+            elif following is None:
+                self.finish(key, self.on_done)
+            else:
+                following.input.put((key, value))
+
+            with stage.lock:
+                stage.starved += start - wait_start
+                stage.busy += end - start
+                stage.blocked += time.monotonic() - end
+                if failed:
+                    stage.errors += 1
+                else:
+                    stage.items += 1
+
+    def log_stats(self):
+        now = time.monotonic()
+        interval = now - self.stats_start
+        self.stats_start = now
+        logging.info(f"Pipeline: {self.in_flight} in flight over {interval:.0f}s")
+        for stage in self.stages:
+            logging.info(stage.stats(interval))
+
+    def stop(self):
+        # Stages are stopped in order once their queue is empty, so items
+        # already in the pipeline are finished first
+        for stage in self.stages:
+            for _ in stage.workers:
+                stage.input.put(_STOP)
+            for thread in stage.workers:
+                thread.join()
+            stage.workers = []
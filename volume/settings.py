@@ -132,6 +132,12 @@ DATE_FORMAT = "Y-m-d"
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / "static"
 
+
+# Cache of minute data for completed days
+
+DAY_CACHE_DIR = BASE_DIR / "day_cache"
+DAY_CACHE_MAX_BYTES = 1024**3
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,43 @@
+
+function chart_data_url() {
+	var url = new URL(window.location.href);
+	url.searchParams.set('format', 'json');
+	return url;
+}
+
+function decode_trace(trace) {
+	// Times are sent as a start in milliseconds and minute offsets from it
+	trace.x = trace.offsets.map(function(offset) { return trace.start + offset * 60000; });
+	delete trace.start;
+	delete trace.offsets;
+	return trace;
+}
+
+function show_chart_error(message) {
+	var error_box = document.createElement('div');
+	error_box.className = 'alert alert-danger';
+	error_box.textContent = 'Could not load chart data: ' + message;
+	document.getElementById(PLOT_TARGET).replaceChildren(error_box);
+}
+
+function load_chart(layout) {
+	fetch(chart_data_url())
+		.then(function(response) {
+			if (!response.ok) {
+				throw new Error(response.status + ' ' + response.statusText);
+			}
+			return response.json();
+		})
+		.then(function(data) {
+			return Plotly.newPlot(PLOT_TARGET, data.traces.map(decode_trace), layout, {responsive: true});
+		})
+		.then(function() {
+			if (LIVE) {
+				ws_connect();
+			}
+		})
+		.catch(function(error) {
+			console.log('Chart data error: ', error);
+			show_chart_error(error.message);
+		});
+}
@@ -2,29 +2,45 @@
 var trace_indices = JSON.parse(document.getElementById('trace_indices').textContent);
 var plot_type = JSON.parse(document.getElementById('plot_type').textContent);
 
-function add_data(plot_name, datetime, value) {
-	var update_data = {
-		x: [[datetime]],
-		y: [[value]],
-	};
-	var index = trace_indices[plot_name];
-
-	if (typeof index !== "undefined") {
-		Plotly.extendTraces(PLOT_TARGET, update_data, [index]);
+function message_value(data) {
+	if (!data.all) {
+		return data.value;
+	} else if (plot_type == "Volume") {
+		return data.volume;
+	} else {
+		return data.slope;
 	}
 }
 
 function handle_ws_data(data) {
-	if (data.all) {
-		if (plot_type == "Volume") {
-			add_data(data.plot_name, data.datetime, data.volume);
-		} else {
-			add_data(data.plot_name, data.datetime, data.slope);
+	// Messages arrive batched per channel, so extend every trace in one call
+	var messages = Array.isArray(data) ? data : [data];
+	var updates = new Map();
+
+	for (var message of messages) {
+		var index = trace_indices[message.plot_name];
+		if (typeof index === "undefined") {
+			continue;
 		}
 
-	} else {
-		add_data(data.plot_name, data.datetime, data.value);
+		if (!updates.has(index)) {
+			updates.set(index, {x: [], y: []});
+		}
+		var update = updates.get(index);
+		update.x.push(message.datetime);
+		update.y.push(message_value(message));
 	}
+
+	if (updates.size == 0) {
+		return;
+	}
+
+	var indices = Array.from(updates.keys());
+	var update_data = {
+		x: indices.map(function(index) { return updates.get(index).x; }),
+		y: indices.map(function(index) { return updates.get(index).y; }),
+	};
+	Plotly.extendTraces(PLOT_TARGET, update_data, indices);
 }
 
 
@@ -52,7 +68,3 @@ function ws_connect() {
 		ws.close();
 	};
 }
-
-if (LIVE) {
-	ws_connect();
-}
@@ -16,7 +16,7 @@ Including another URLconf
 from django.contrib import admin
 from django.contrib.auth import views as auth_views
 from django.urls import path
-from django.views.generic import TemplateView, RedirectView
+from django.views.generic import RedirectView
 
 from . import views
 from .models import Group, group_type_name
@@ -30,7 +30,7 @@ urlpatterns = [
     path("slopes/", views.chart_view, name="slopes", kwargs={"is_slope": True}),
     path("auth", views.auth),
 
-    path("system/", TemplateView.as_view(template_name="system.html"), name="system"),
+    path("system/", views.system, name="system"),
     path("system/live-updates-start", views.live_updates_start, name="live-updates-start"),
     path("system/live-updates-pause", views.live_updates_pause, name="live-updates-pause"),
     path("system/api-test", views.api_test, name="api-test"),
@@ -86,6 +86,7 @@ urlpatterns = [
     path("symbol/<str:symbol>/download-single-day/<str:day>/", views.download_day, name="download-single-day"),
     path("symbol/<str:symbol>/download-multiple/", views.download_multiple, name="download-multiple"),
     path("symbol/<str:symbol>/download-all/", views.download_all, name="download-all"),
+    path("symbol/<str:symbol>/download-summary/", views.download_summary, name="download-summary"),
 
 ]
 
@@ -1,5 +1,8 @@
-from .models import Minute, DataDay, Correlation, Symbol, RollingCorrelation
+import datetime
 
+from .models import Minute, DataDay, Correlation, Symbol
+
+from . import bulk
 from . import calculate
 from . import logic
 from . import market
@@ -73,47 +76,15 @@ def load_all_day_data(symbol, day):
 
 
 def add_correlations(after=None):
-    days = DataDay.objects.filter(state=DataDay.State.COMPLETE)
-    if after is not None:
-        days = days.filter(day__gt=after)
+    start = after + datetime.timedelta(days=1) if after is not None else None
+    count = logic.update_correlations(start=start)
+    print(f"Saved {count} correlations")
 
-    print(f"There are {len(days)} days")
 
-    for i, day in enumerate(days):
-        print(i, day)
-        if Correlation.objects.filter(symbol=day.symbol, day=day.day).count() == len(Correlation.DataType):
-            continue
-
-        data = logic.data_day(day.symbol, day.day)
-
-        if not Correlation.objects.filter(symbol=day.symbol,
-                                          day=day.day,
-                                          data_type=Correlation.DataType.VOLUME).exists():
-            try:
-                corr = calculate.volume_correlation(data)
-                c = Correlation(
-                    symbol=day.symbol,
-                    day=day.day,
-                    data_type=Correlation.DataType.VOLUME,
-                    value=corr)
-                c.save()
-            except (ValueError, TypeError):
-                pass
-
-
-        if not Correlation.objects.filter(symbol=day.symbol,
-                                          day=day.day,
-                                          data_type=Correlation.DataType.SLOPE).exists():
-            try:
-                corr = calculate.slope_correlation(data)
-                c = Correlation(
-                    symbol=day.symbol,
-                    day=day.day,
-                    data_type=Correlation.DataType.SLOPE,
-                    value=corr)
-                c.save()
-            except (ValueError, TypeError):
-                pass
+def add_day_summaries(after=None):
+    start = after + datetime.timedelta(days=1) if after is not None else None
+    count = logic.update_day_summaries(start=start)
+    print(f"Saved {count} day summaries")
 
 
 def add_rolling_correlations(after=None):
@@ -127,6 +98,6 @@ def add_rolling_correlations(after=None):
         print(i, day)
 
         rolls = logic.rolling_correlations_for_day(day.symbol, day.day)
-        RollingCorrelation.objects.bulk_create(rolls)
+        bulk.copy_objects(rolls, bulk.ROLLING_CORRELATION_KEY)
 
         print(f"Saved {len(rolls)} minutes")
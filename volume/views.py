@@ -1,12 +1,17 @@
 import datetime
+import hashlib
+import json
 import operator
 
+import numpy
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Count, Q, Min, Exists, OuterRef
+from django.db.models import Count, Q, Min, Max, Exists, OuterRef
 from django.http import HttpResponse, FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 from django.views.decorators.http import require_POST
 from django.views.generic import ListView
 from django.utils import timezone
@@ -15,11 +20,17 @@ from .models import Symbol, DataDay, IndexWeight, Chart, Correlation, Group, gro
 from . import logic
 from . import market
 from . import api
+from . import calculate
 
 
 DATE_FORMAT = "%Y-%m-%d"
-CHART_DATETIME_FORMAT = "%F %T"
 DAYS_ON_CHART = 3
+CHART_RANGES = (3, 5, 10, 20, 60, 120, 250)
+MAX_DAYS_ON_CHART = 250
+CHART_POINTS = 1500
+MIN_CHART_POINTS = 100
+MAX_CHART_POINTS = 10000
+SECONDS_PER_DAY = 24 * 60 * 60
 
 
 @login_required
@@ -32,7 +43,7 @@ class StocksView(LoginRequiredMixin, ListView):
     template_name = "stocks.html"
 
     def get_queryset(self):
-        count_pending = Count("dataday", filter=Q(dataday__state=DataDay.State.PENDING))
+        count_pending = Count("dataday", filter=Q(dataday__state__in=[DataDay.State.PENDING, DataDay.State.RUNNING]))
         qs = Symbol.objects.stocks().order_by("symbol")
         qs = qs.annotate(pending=count_pending)
         qs = qs.annotate(first=Min("dataday__day"))
@@ -44,7 +55,7 @@ class IndicesView(LoginRequiredMixin, ListView):
     template_name = "indices.html"
 
     def get_queryset(self):
-        count_pending = Count("dataday", filter=Q(dataday__state=DataDay.State.PENDING))
+        count_pending = Count("dataday", filter=Q(dataday__state__in=[DataDay.State.PENDING, DataDay.State.RUNNING]))
         qs = Symbol.objects.indices().order_by("symbol")
         qs = qs.annotate(pending=count_pending)
         qs = qs.annotate(first=Min("dataday__day"))
@@ -67,7 +78,7 @@ class IndexView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         self.index = get_object_or_404(Symbol, symbol=self.kwargs["symbol"])
-        return DataDay.objects.filter(symbol=self.index)
+        return DataDay.objects.filter(symbol=self.index).select_related("summary")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -100,7 +111,7 @@ class StockView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         self.symbol = get_object_or_404(Symbol, symbol=self.kwargs["symbol"])
-        return DataDay.objects.filter(symbol=self.symbol)
+        return DataDay.objects.filter(symbol=self.symbol).select_related("summary")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -124,15 +135,102 @@ class ChartEditView(LoginRequiredMixin, ListView):
 
 
 def latest_day(request):
-    day = request.GET.get("latest_day", "today")
+    day = request.GET.get("latest_day") or "today"
     if day == "today":
         return datetime.date.today()
     else:
         return datetime.datetime.strptime(day, DATE_FORMAT).date()
 
 
+def int_param(request, name, default, minimum, maximum):
+    try:
+        value = int(request.GET.get(name, default))
+    except ValueError:
+        value = default
+
+    return min(max(value, minimum), maximum)
+
+
+def chart_days(request):
+    return int_param(request, "days", DAYS_ON_CHART, 1, MAX_DAYS_ON_CHART)
+
+
+def chart_points(request):
+    return int_param(request, "points", CHART_POINTS, MIN_CHART_POINTS, MAX_CHART_POINTS)
+
+
+def utc_offsets(times, tz):
+    # Offset of tz from UTC for each epoch second, looked up once per day
+    days, inverse = numpy.unique(times // SECONDS_PER_DAY, return_inverse=True)
+    offsets = [datetime.datetime.fromtimestamp(day * SECONDS_PER_DAY + SECONDS_PER_DAY // 2, tz).utcoffset().total_seconds()
+               for day in days.tolist()]
+    return numpy.array(offsets, dtype=numpy.int64)[inverse]
+
+
+def chart_series(times, values, points, tz):
+    # Downsampled series as a start time in milliseconds and minute offsets
+    # from it. Times are shifted to wall-clock time in tz, as Plotly shows
+    # numeric dates as UTC.
+    indices = calculate.downsample(times, values, points)
+    times = times[indices]
+    if not len(times):
+        return {"start": 0, "offsets": [], "y": []}
+
+    local_times = times + utc_offsets(times, tz)
+    start = int(local_times[0])
+    return {
+        "start": start * 1000,
+        "offsets": ((local_times - start) // 60).tolist(),
+        "y": logic.json_column(values[indices]),
+    }
+
+
+def wants_json(request):
+    return request.GET.get("format") == "json"
+
+
+def chart_validators(request, symbol_objs, days, is_today):
+    # ETag and Last-Modified for chart data from the state of its DataDays
+    # and its rolling correlations, which can be backfilled after a day is
+    # complete without touching the DataDay
+    if is_today:
+        return None, None
+
+    rows = list(DataDay.objects.filter(symbol__in=symbol_objs, day__in=days)
+                .order_by("symbol_id", "day")
+                .values_list("symbol_id", "day", "state", "modified"))
+    rolling = (RollingCorrelation.timescale.filter(logic.days_query(days), symbol__in=symbol_objs)
+               .aggregate(count=Count("time"), latest=Max("time")))
+    symbol_info = [(symbol.symbol, symbol.display_name, symbol.colour) for symbol in symbol_objs]
+    etag = hashlib.md5(repr((request.get_full_path(), symbol_info, rows, rolling)).encode()).hexdigest()
+
+    modified = [row[3] for row in rows]
+    last_modified = None
+    if modified and None not in modified:
+        last_modified = int(max(modified).timestamp())
+
+    return quote_etag(etag), last_modified
+
+
+def chart_data_response(data, etag, last_modified):
+    content = json.dumps({"traces": data}, separators=(",", ":"), allow_nan=False)
+    response = HttpResponse(content, content_type="application/json")
+
+    if etag is not None:
+        response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+
+    # Browsers revalidate every time; unchanged data gets a 304 without
+    # being rebuilt
+    patch_cache_control(response, private=True, no_cache=True)
+
+    return response
+
+
 def chart_dates(request):
     day = latest_day(request)
+    range_days = chart_days(request)
 
     is_today = day == datetime.date.today()
     previous_day = market.previous_trading_day(day)
@@ -140,7 +238,7 @@ def chart_dates(request):
 
     current = day
     days = []
-    while len(days) < DAYS_ON_CHART:
+    while len(days) < range_days:
         if market.is_weekday(current):
             days.append(current)
         current = market.previous_trading_day(current)
@@ -267,7 +365,10 @@ def comparison_table_view(request, slug):
     else:
         _, end_time = market.first_last_minute(day)
 
-    data = logic.comparison_table_data(symbols, start_time, end_time, use_previous_close)
+    if start_time_str or end_time_str or is_today:
+        data = logic.comparison_table_data(symbols, start_time, end_time, use_previous_close)
+    else:
+        data = logic.comparison_table_summary(symbols, day, use_previous_close)
 
     return render(request, "comparison_table.html", locals())
 
@@ -277,69 +378,80 @@ def stock_view(request, symbol, is_slope=False, with_correlations=False):
     symbol_obj = Symbol.objects.get(symbol=symbol)
     start, end, day, previous_day, next_day, is_today, days = chart_dates(request)
     holiday = logic.holiday_for_day()
+    ranges = CHART_RANGES
+    range_days = len(days)
+    points = chart_points(request)
 
-    data = []
     tz = timezone.get_current_timezone()
     data_field_name = "slope" if is_slope else "cumulative_volume"
     data_display_name = "Slope" if is_slope else "Volume"
     right_axis_display_name = "Price"
     plot_type = "Slope" if is_slope else "Volume"
 
-    dates = []
-    volumes = []
-    prices = []
-    for date in days:
-        qs = logic.data_day(symbol, date)
-        new_dates = list(qs.values_list("time", flat=True))
+    trace_indices = {
+        data_display_name: 0,
+        "Price": 1,
+    }
+
+    if not wants_json(request):
+        return render(request, "stock_view.html", locals())
 
-        dates += new_dates
-        volumes += list(qs.values_list(data_field_name, flat=True))
-        prices += list(qs.values_list("last", flat=True))
+    etag, last_modified = chart_validators(request, [symbol_obj], days, is_today)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
 
-        # Add break after
-        if not date == timezone.localdate() and new_dates:
-            dates.append(new_dates[-1] + datetime.timedelta(minutes=1))
-            volumes.append(None)
-            prices.append(None)
+    resolution = logic.chart_resolution(days, points)
+    columns = logic.chart_columns([symbol], days, [data_field_name, "last"], resolution)[symbol]
 
-    dates = [dt.astimezone(tz).strftime(CHART_DATETIME_FORMAT) for dt in dates]
     data = [
         {
             "type": "scatter",
             "mode": "lines",
             "name": data_display_name,
-            "x": dates,
-            "y": volumes,
             "connectgaps": False,
+            **chart_series(columns["time"], columns[data_field_name], points, tz),
         },
         {
             "type": "scatter",
             "mode": "lines",
             "name": "Price",
-            "x": dates,
-            "y": prices,
             "yaxis": "y2",
             "connectgaps": False,
+            **chart_series(columns["time"], columns["last"], points, tz),
         },
     ]
 
     if is_slope:
         data[0]["line"] = {"color": "#2ca02c"}
 
-    trace_indices = {
-        data_display_name: 0,
-        "Price": 1,
-    }
+    return chart_data_response(data, etag, last_modified)
+
+
+def correlation_window(request):
+    try:
+        window = int(request.GET.get("window", logic.ROLLING_CORRELATION_WINDOW))
+    except ValueError:
+        window = logic.ROLLING_CORRELATION_WINDOW
 
-    return render(request, "stock_view.html", locals())
+    if window not in logic.ROLLING_CORRELATION_WINDOWS:
+        window = logic.ROLLING_CORRELATION_WINDOW
+
+    return window
 
 
 def _rolling_correlation_view(request, symbol, against):
     symbol_obj = Symbol.objects.get(symbol=symbol)
     start, end, day, previous_day, next_day, is_today, days = chart_dates(request)
     holiday = logic.holiday_for_day()
+    ranges = CHART_RANGES
+    range_days = len(days)
+    points = chart_points(request)
+    window = correlation_window(request)
+    windows = logic.ROLLING_CORRELATION_WINDOWS
+    volume_correlation_name = f"Volume Correlation ({window}m)"
+    slope_correlation_name = f"Slope Correlation ({window}m)"
 
-    data = []
     tz = timezone.get_current_timezone()
     if against == "price":
         data_field_name = "last"
@@ -354,71 +466,55 @@ def _rolling_correlation_view(request, symbol, against):
     right_axis_display_name = "Correlation"
     plot_type = "Correlation"
 
-    dates = []
-    volume_correlations = []
-    slope_correlations = []
-    against_data = []
-
-    for date in days:
-        qs = logic.data_day(symbol, date)
-        new_dates = list(qs.values_list("time", flat=True))
-
-        dates += new_dates
-        against_data += list(qs.values_list(data_field_name, flat=True))
-
-        volume_qs = logic.rolling_correlation_data_day(symbol, date, RollingCorrelation.DataType.VOLUME)
-        slope_qs = logic.rolling_correlation_data_day(symbol, date, RollingCorrelation.DataType.SLOPE)
-
-        volume_dict = {m.time: m.value for m in volume_qs}
-        volume_correlations += [volume_dict.get(date) for date in new_dates]
+    trace_indices = {
+        data_display_name: 0,
+        volume_correlation_name: 1,
+        slope_correlation_name: 2,
+    }
 
-        slope_dict = {m.time: m.value for m in slope_qs}
-        slope_correlations += [slope_dict.get(date) for date in new_dates]
+    if not wants_json(request):
+        return render(request, "stock_view.html", locals())
 
-        # Add break after
-        if not date == timezone.localdate():
-            if new_dates:
-                dates.append(new_dates[-1] + datetime.timedelta(minutes=1))
-                against_data.append(None)
-                volume_correlations.append(None)
-                slope_correlations.append(None)
+    etag, last_modified = chart_validators(request, [symbol_obj], days, is_today)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
 
-    dates = [dt.astimezone(tz).strftime(CHART_DATETIME_FORMAT) for dt in dates]
+    resolution = logic.chart_resolution(days, points)
+    columns = logic.chart_columns([symbol], days, [data_field_name], resolution)[symbol]
+    correlations = logic.rolling_correlation_columns(symbol, days, window, columns["time"])
 
     data = [
         {
             "type": "scatter",
             "mode": "lines",
             "name": data_display_name,
-            "x": dates,
-            "y": against_data,
             "connectgaps": False,
+            **chart_series(columns["time"], columns[data_field_name], points, tz),
         },
         {
             "type": "scatter",
             "mode": "lines",
-            "name": "Volume Correlation (15m)",
-            "x": dates,
-            "y": volume_correlations,
+            "name": volume_correlation_name,
             "yaxis": "y2",
             "connectgaps": False,
             "line": {
                 "color": "#d62728",
             },
             "hovertemplate": "%{y:,.2f}",
+            **chart_series(columns["time"], correlations[RollingCorrelation.DataType.VOLUME], points, tz),
         },
         {
             "type": "scatter",
             "mode": "lines",
-            "name": "Slope Correlation (15m)",
-            "x": dates,
-            "y": slope_correlations,
+            "name": slope_correlation_name,
             "yaxis": "y2",
             "connectgaps": False,
             "line": {
                 "color": "#9467bd",
             },
             "hovertemplate": "%{y:,.2f}",
+            **chart_series(columns["time"], correlations[RollingCorrelation.DataType.SLOPE], points, tz),
         },
     ]
 
@@ -427,13 +523,7 @@ def _rolling_correlation_view(request, symbol, against):
     elif against == "slope":
         data[0]["line"] = {"color": "#2ca02c"}
 
-    trace_indices = {
-        data_display_name: 0,
-        "Volume Correlation (15m)": 1,
-        "Slope Correlation (15m)": 2,
-    }
-
-    return render(request, "stock_view.html", locals())
+    return chart_data_response(data, etag, last_modified)
 
 
 @login_required
@@ -460,6 +550,9 @@ def stock_view_slope(request, symbol):
 def chart_view(request, slug=None, is_slope=False):
     start, end, day, previous_day, next_day, is_today, days = chart_dates(request)
     holiday = logic.holiday_for_day()
+    ranges = CHART_RANGES
+    range_days = len(days)
+    points = chart_points(request)
 
     if slug is None or slug == "all":
         symbols = Symbol.objects.all()
@@ -474,32 +567,31 @@ def chart_view(request, slug=None, is_slope=False):
     plot_type = "Slope" if is_slope else "Volume"
     data_field_name = "slope" if is_slope else "cumulative_volume"
 
-    data = []
     tz = timezone.get_current_timezone()
 
-    for symbol in symbols:
-        dates = []
-        volumes = []
-        for date in days:
-            qs = logic.data_day(symbol.symbol, date)
-            new_dates = list(qs.values_list("time", flat=True))
+    symbols = list(symbols)
+    trace_indices = {symbol.symbol: i for i, symbol in enumerate(symbols)}
 
-            dates += new_dates
-            volumes += list(qs.values_list(data_field_name, flat=True))
+    if not wants_json(request):
+        return render(request, "chart.html", locals())
 
-            # Add break after
-            if not date == timezone.localdate() and new_dates:
-                dates.append(new_dates[-1] + datetime.timedelta(minutes=1))
-                volumes.append(None)
+    etag, last_modified = chart_validators(request, symbols, days, is_today)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
 
-        dates = [dt.astimezone(tz).strftime(CHART_DATETIME_FORMAT) for dt in dates]
+    resolution = logic.chart_resolution(days, points)
+    all_columns = logic.chart_columns([symbol.symbol for symbol in symbols], days, [data_field_name], resolution)
+
+    data = []
+    for symbol in symbols:
+        columns = all_columns[symbol.symbol]
         series = {
             "type": "scatter",
             "mode": "lines",
             "name": symbol.display_name,
-            "x": dates,
-            "y": volumes,
             "connectgaps": False,
+            **chart_series(columns["time"], columns[data_field_name], points, tz),
         }
 
         if symbol.colour is not None:
@@ -509,9 +601,7 @@ def chart_view(request, slug=None, is_slope=False):
 
         data.append(series)
 
-    trace_indices = {symbol.symbol: i for i, symbol in enumerate(symbols)}
-
-    return render(request, "chart.html", locals())
+    return chart_data_response(data, etag, last_modified)
 
 
 def group_home(group_type):
@@ -703,7 +793,7 @@ def csv_response(csv, filename):
 @login_required
 def download_all(request, symbol):
     name = logic.name_for_symbol(symbol)
-    csv = logic.stream_data_csv(logic.data_all(symbol))
+    csv = logic.stream_days_csv(symbol, logic.data_days(symbol))
     return streaming_csv_response(csv, f"{name}.csv")
 
 
@@ -711,19 +801,32 @@ def download_all(request, symbol):
 @login_required
 def download_multiple(request, symbol):
     name = logic.name_for_symbol(symbol)
-    days = [datetime.datetime.strptime(d, DATE_FORMAT) for d in request.POST.getlist("day")]
-    csv = logic.stream_data_csv(logic.data_multiple(symbol, days))
+    days = [datetime.datetime.strptime(d, DATE_FORMAT).date() for d in request.POST.getlist("day")]
+    csv = logic.stream_days_csv(symbol, days)
     return streaming_csv_response(csv, f"{name}.csv")
 
+@login_required
+def download_summary(request, symbol):
+    name = logic.name_for_symbol(symbol)
+    csv = logic.stream_summary_csv(symbol)
+    return streaming_csv_response(csv, f"{name} summary.csv")
+
+
 @login_required
 def download_day(request, symbol, day):
     name = logic.name_for_symbol(symbol)
     day = datetime.datetime.strptime(day, DATE_FORMAT).date()
-    csv = logic.stream_data_csv(logic.data_day(symbol, day))
+    csv = logic.stream_days_csv(symbol, [day])
     filename = f"{name} {day:{DATE_FORMAT}}.csv"
     return streaming_csv_response(csv, filename)
 
 
+@login_required
+def system(request):
+    live_tick_seconds = logic.live_tick_seconds()
+    return render(request, "system.html", locals())
+
+
 @require_POST
 @login_required
 def live_updates_start(request):
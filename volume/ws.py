@@ -1,4 +1,6 @@
 import logging
+import threading
+from collections import OrderedDict, defaultdict
 
 import requests
 
@@ -10,92 +12,181 @@ from .models import RollingCorrelation
 
 URL = "http://localhost:8081/pub"
 TIMEOUT = 5
+QUEUE_SIZE = 500  # Channels waiting to be sent
+CHANNEL_QUEUE_SIZE = 1000  # Messages kept per channel
+DRAIN_TIMEOUT = 30
 CHART_DATETIME_FORMAT = "%F %T"
 
 
+# Kept-alive connection to the pub server
+session = requests.Session()
+
+
 def push_html_to_ws(channel, html):
     params = {"channel": channel}
-    r = requests.post(URL, params=params, data=html, timeout=TIMEOUT)
+    r = session.post(URL, params=params, data=html, timeout=TIMEOUT)
     return r.ok
 
 
 def push_to_ws(channel, data):
     params = {"channel": channel}
-    r = requests.post(URL, params=params, json=data, timeout=TIMEOUT)
+    r = session.post(URL, params=params, json=data, timeout=TIMEOUT)
     return r.ok
 
 
-def send_for_all(minute):
+def format_time(dt):
     tz = timezone.get_current_timezone()
-    data = {
+    return dt.astimezone(tz).strftime(CHART_DATETIME_FORMAT)
+
+
+def minute_for_all(minute):
+    return {
         "all": True,
         "plot_name": minute.symbol.symbol,
-        "datetime": minute.time.astimezone(tz).strftime(CHART_DATETIME_FORMAT),
+        "datetime": format_time(minute.time),
         "volume": minute.cumulative_volume,
         "slope": minute.slope,
     }
-    push_to_ws("all", data)
-
-
-def send_for_symbol(minute):
-    tz = timezone.get_current_timezone()
-    channel = f"stock_{minute.symbol.symbol}"
-    volume_data = {
-        "all": False,
-        "plot_name": "Volume",
-        "datetime": minute.time.astimezone(tz).strftime(CHART_DATETIME_FORMAT),
-        "value": minute.cumulative_volume,
-    }
-    push_to_ws(channel, volume_data)
 
-    slope_data = {
-        "all": False,
-        "plot_name": "Slope",
-        "datetime": minute.time.astimezone(tz).strftime(CHART_DATETIME_FORMAT),
-        "value": minute.slope,
-    }
-    push_to_ws(channel, slope_data)
 
-    price_data = {
-        "all": False,
-        "plot_name": "Price",
-        "datetime": minute.time.astimezone(tz).strftime(CHART_DATETIME_FORMAT),
-        "value": minute.last,
-    }
-    push_to_ws(channel, price_data)
+def minute_for_symbol(minute):
+    time = format_time(minute.time)
+    return [
+        {
+            "all": False,
+            "plot_name": plot_name,
+            "datetime": time,
+            "value": value,
+        }
+        for plot_name, value in (("Volume", minute.cumulative_volume),
+                                 ("Slope", minute.slope),
+                                 ("Price", minute.last))
+    ]
 
 
-def send_rolling_correlation(roll):
-    tz = timezone.get_current_timezone()
-    channel = f"stock_{roll.symbol.symbol}"
-
+def rolling_correlation_data(roll):
     plot_name = "Volume" if roll.data_type == RollingCorrelation.DataType.VOLUME else "Slope"
     plot_name += f" Correlation ({roll.window}m)"
 
-    roll_data = {
+    return {
         "all": False,
         "plot_name": plot_name,
-        "datetime": roll.time.astimezone(tz).strftime(CHART_DATETIME_FORMAT),
+        "datetime": format_time(roll.time),
         "value": roll.value,
     }
 
-    push_to_ws(channel, roll_data)
 
+class Sender:
+    # Sends queued messages from a background thread so a slow or down pub
+    # server never holds up ingestion. Messages for the same channel are
+    # coalesced: JSON arrays are joined and a newer HTML table replaces the
+    # stale one. When the queue is full the oldest messages are dropped.
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = OrderedDict()
+        self.sending = False
+        self.dropped = 0
+        self.failed = 0
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="ws-sender", daemon=True)
+            self.thread.start()
+
+    def put_json(self, channel, messages):
+        with self.condition:
+            _, queued = self.pending.get(channel, (False, []))
+            queued = queued + messages
+
+            overflow = len(queued) - CHANNEL_QUEUE_SIZE
+            if overflow > 0:
+                queued = queued[overflow:]
+                self.dropped += overflow
+
+            self.pending[channel] = (False, queued)
+            self.enqueued()
+
+    def put_html(self, channel, html):
+        with self.condition:
+            if channel in self.pending:
+                self.dropped += 1
+
+            self.pending[channel] = (True, html)
+            self.enqueued()
+
+    def enqueued(self):
+        # Called with the condition held
+        while len(self.pending) > QUEUE_SIZE:
+            _, (is_html, payload) = self.pending.popitem(last=False)
+            self.dropped += 1 if is_html else len(payload)
+
+        self.start()
+        self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending)
+                channel, (is_html, payload) = self.pending.popitem(last=False)
+                self.sending = True
+
+            try:
+                if is_html:
+                    ok = push_html_to_ws(channel, payload)
+                else:
+                    ok = push_to_ws(channel, payload)
+            except Exception:
+                logging.exception("Exception sending to websocket")
+                ok = False
+
+            with self.condition:
+                if not ok:
+                    self.failed += 1
+                self.sending = False
+                self.condition.notify_all()
+
+    def wait(self, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and not self.sending, timeout)
+
+    def depth(self):
+        with self.condition:
+            return sum(1 if is_html else len(payload)
+                       for is_html, payload in self.pending.values())
+
+    def stats(self):
+        depth = self.depth()
+        with self.condition:
+            return {"depth": depth, "dropped": self.dropped, "failed": self.failed}
+
+
+sender = Sender()
+
+
+class Publisher:
+    # Collects the messages for a tick and queues one array per channel
+
+    def __init__(self):
+        self.messages = defaultdict(list)
+
+    def add_minute(self, minute):
+        self.messages["all"].append(minute_for_all(minute))
+        self.messages[f"stock_{minute.symbol.symbol}"] += minute_for_symbol(minute)
 
-def send_minute(minute):
-    try:
-        send_for_all(minute)
-        send_for_symbol(minute)
-    except Exception:
-        logging.exception("Exception sending to websocket")
+    def add_rolling_correlation(self, roll):
+        self.messages[f"stock_{roll.symbol.symbol}"].append(rolling_correlation_data(roll))
+
+    def flush(self):
+        messages, self.messages = self.messages, defaultdict(list)
+        for channel, data in messages.items():
+            sender.put_json(channel, data)
 
 
 def send_correlations(slug, correlations, data_type):
     html = views.correlation_partial_table(correlations, data_type)
-    try:
-        push_html_to_ws(f"correlations_{slug}", html)
-    except Exception:
-        logging.exception("Exception sending to websocket")
+    sender.put_html(f"correlations_{slug}", html)
 
 
 def send_slope_table(group):
@@ -104,7 +195,4 @@ def send_slope_table(group):
     else:
         slug = group.slug
     html = views.slope_partial_table(group)
-    try:
-        push_html_to_ws(f"slope_table_{slug}", html)
-    except Exception:
-        logging.exception("Exception sending to websocket")
+    sender.put_html(f"slope_table_{slug}", html)